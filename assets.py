@@ -0,0 +1,152 @@
+"""Build step for static/: minified, fingerprinted CSS and JS with gzip and brotli copies.
+
+    python assets.py            # writes static/dist/ and static/dist/manifest.json
+
+Images are left alone: their URLs end up in cached user profiles and stored
+messages, which must keep working after the next build.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+
+from werkzeug.http import parse_accept_header
+
+ASSET_DIRS = ('css', 'js')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Fingerprinted files never change, so browsers may keep them for a year without asking
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def minify(name, data):
+    import rcssmin
+    import rjsmin
+    if name.endswith('.css'):
+        return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8')
+    if name.endswith('.js'):
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def build(static_dir):
+    """Write the build to ``static_dir``/dist and return the manifest.
+
+    The manifest maps each source path (``js/chat.js``) to its built path
+    (``dist/js/chat.<hash>.js``), both relative to the static folder. A gzip
+    and, when the brotli package is installed, a brotli copy are written next
+    to every file they make smaller.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print('brotli is not installed, writing gzip copies only')
+
+    manifest = {}
+    for directory in ASSET_DIRS:
+        source_dir = os.path.join(static_dir, directory)
+        if not os.path.isdir(source_dir):
+            continue
+        os.makedirs(os.path.join(static_dir, DIST_DIR, directory), exist_ok=True)
+        for name in sorted(os.listdir(source_dir)):
+            with open(os.path.join(source_dir, name), 'rb') as f:
+                source = f.read()
+            data = minify(name, source)
+            stem, ext = os.path.splitext(name)
+            built = f'{DIST_DIR}/{directory}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            path = os.path.join(static_dir, built)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+            sizes = [f'{len(source)} -> {len(data)}']
+            variants = [('gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if len(compressed) < len(data):
+                    with open(f'{path}.{suffix}', 'wb') as f:
+                        f.write(compressed)
+                    sizes.append(f'{suffix} {len(compressed)}')
+            print(f'{directory}/{name}: {", ".join(sizes)} bytes')
+            manifest[f'{directory}/{name}'] = built
+
+    with open(os.path.join(static_dir, DIST_DIR, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """Serves the build from ``python assets.py`` in place of the source files.
+
+    url_for('static', filename='js/chat.js') returns the fingerprinted URL from
+    the manifest, so templates need no changes. Those URLs are answered by a
+    WSGI middleware from copies loaded into memory at startup, with an
+    immutable Cache-Control header and the smallest encoding the browser
+    accepts; they never reach Flask, whose session handling would add
+    ``Vary: Cookie``. Everything else, and everything when the manifest is
+    missing or ``enabled`` is off, is served by Flask as before.
+    """
+
+    def __init__(self, app, manifest_path, enabled=True):
+        self.files = {}
+        self.served = {}  # URL path -> {encoding: body}, '' being the uncompressed file
+
+        if not enabled:
+            return
+        if not os.path.exists(manifest_path):
+            print(f"Static asset manifest {manifest_path} not found, serving unbuilt files (run python assets.py)")
+            return
+        with open(manifest_path) as f:
+            self.files = json.load(f)
+        for built in self.files.values():
+            path = os.path.join(app.static_folder, built)
+            bodies = {}
+            for encoding, suffix in (('', ''), ('br', '.br'), ('gzip', '.gz')):
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, 'rb') as f:
+                        bodies[encoding] = f.read()
+            self.served[f'{app.static_url_path}/{built}'] = bodies
+
+        app.url_defaults(self.fingerprint)
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+
+    def fingerprint(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        bodies = self.served.get(path)
+        if bodies is None or environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return self.wsgi_app(environ, start_response)
+
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        encoding = next((encoding for encoding in ('br', 'gzip')
+                         if encoding in bodies and accepted.quality(encoding) > 0), '')
+        body = bodies[encoding]
+        etag = f'"{os.path.basename(path)}{"-" + encoding if encoding else ""}"'
+        headers = [
+            ('Content-Type', f'{mimetypes.guess_type(path)[0]}; charset=utf-8'),
+            ('Cache-Control', IMMUTABLE),
+            ('Vary', 'Accept-Encoding'),
+            ('ETag', etag),
+        ]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', headers)
+            return [b'']
+        headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', headers)
+        return [b''] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
+
+
+if __name__ == '__main__':
+    static = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    build(static)
@@ -0,0 +1,139 @@
+import time
+
+AUTHOR_COLUMNS = ('name', 'profile_img')
+
+
+def has_author_columns(db, connection, table='messages'):
+    # Whether messages still carries the sender name and picture copied from users
+    columns = {column['name'] for column in db.inspect(connection).get_columns(table)}
+    return all(name in columns for name in AUTHOR_COLUMNS)
+
+
+class AuthorBackfill:
+    """Moves what messages know about their senders into users, in batches of message ids.
+
+    Messages used to store a copy of the sender's name and picture. Before
+    those columns are dropped, every sender in them gets a users row: a
+    placeholder like the ones imports add, carrying the name and picture of
+    their newest message, for authors who never logged in. Users who did keep
+    their name, since logins refresh it, and get a picture only if they have
+    none.
+
+    Rows are read ``batch_size`` at a time in id order. Without a
+    ``connection`` each batch is its own transaction, so the app keeps
+    running meanwhile; the last id done is kept in ``author_backfill`` and the
+    next run carries on from there. Rows written without a name (by workers
+    that no longer fill these columns) are skipped.
+    """
+
+    PROGRESS_TABLE = 'author_backfill'
+
+    def __init__(self, db, users_table, messages_table='messages', batch_size=5000, pause=0):
+        self.db = db
+        self.users = users_table
+        # Only the columns read here; the model no longer maps name and profile_img
+        self.messages = db.table(messages_table, *(db.column(name) for name in ('id', 'user_id') + AUTHOR_COLUMNS))
+        self.batch_size = batch_size
+        self.pause = pause
+        self.scanned = 0
+        self.created_users = 0
+        self.updated_users = 0
+
+    def run(self, connection=None):
+        """Process every row after the saved progress; returns the number of rows read."""
+        if connection is not None:
+            after_id = self._progress(connection)
+            while after_id is not None:
+                after_id = self._batch(connection, after_id)
+            return self.scanned
+
+        with self.db.engine.begin() as connection:
+            after_id = self._progress(connection)
+        while after_id is not None:
+            with self.db.engine.begin() as connection:
+                after_id = self._batch(connection, after_id)
+            if after_id is not None and self.pause:
+                time.sleep(self.pause)
+        return self.scanned
+
+    @staticmethod
+    def placeholder_email(user_id):
+        # Same address MessageImporter gives the authors it adds
+        return f'{user_id}@imported.invalid'
+
+    def _progress(self, connection):
+        connection.execute(self.db.text(
+            f'CREATE TABLE IF NOT EXISTS {self.PROGRESS_TABLE} (id INTEGER PRIMARY KEY, last_id INTEGER NOT NULL)'))
+        last_id = connection.execute(self.db.text(
+            f'SELECT last_id FROM {self.PROGRESS_TABLE} WHERE id = 1')).scalar()
+        if last_id is None:
+            connection.execute(self.db.text(f'INSERT INTO {self.PROGRESS_TABLE} (id, last_id) VALUES (1, 0)'))
+            last_id = 0
+        return last_id
+
+    def _batch(self, connection, after_id):
+        # Returns the last id of the batch, or None once there is nothing left
+        messages = self.messages.c
+        rows = connection.execute(
+            self.db.select(messages.id, messages.user_id, messages.name, messages.profile_img)
+            .where(messages.id > after_id)
+            .order_by(messages.id)
+            .limit(self.batch_size)
+        ).all()
+        if not rows:
+            return None
+
+        newest = {}
+        for row in rows:
+            if row.name is not None:
+                newest[row.user_id] = row
+        if not newest:
+            return self._advance(connection, rows)
+
+        existing = {user.id: user for user in connection.execute(
+            self.db.select(self.users.c.id, self.users.c.email, self.users.c.profile_img)
+            .where(self.users.c.id.in_(list(newest)))
+        )}
+
+        missing = [{'id': user_id, 'name': row.name, 'email': self.placeholder_email(user_id),
+                    'profile_img': row.profile_img}
+                   for user_id, row in newest.items() if user_id not in existing]
+        if missing:
+            connection.execute(self.users.insert(), missing)
+            self.created_users += len(missing)
+
+        # Placeholders follow the newest message; real users only fill a missing picture
+        updates = []
+        for user_id, row in newest.items():
+            user = existing.get(user_id)
+            if user is None:
+                continue
+            if user.email == self.placeholder_email(user_id):
+                updates.append({'user_id': user_id, 'new_name': row.name, 'picture': row.profile_img})
+            elif user.profile_img is None and row.profile_img and row.profile_img.startswith('http'):
+                updates.append({'user_id': user_id, 'new_name': None, 'picture': row.profile_img})
+        if updates:
+            users = self.users.c
+            connection.execute(
+                self.users.update()
+                .where(users.id == self.db.bindparam('user_id'))
+                .values(name=self.db.func.coalesce(self.db.bindparam('new_name'), users.name),
+                        profile_img=self.db.bindparam('picture')),
+                updates)
+            self.updated_users += len(updates)
+
+        return self._advance(connection, rows)
+
+    def _advance(self, connection, rows):
+        last_id = rows[-1].id
+        connection.execute(self.db.text(f'UPDATE {self.PROGRESS_TABLE} SET last_id = :last_id WHERE id = 1'),
+                           {'last_id': last_id})
+        self.scanned += len(rows)
+        return last_id
+
+    def finish(self, connection):
+        # Drop the copied columns and the progress table; run after a full pass on the same
+        # connection, once nothing writes the columns any more
+        for name in AUTHOR_COLUMNS:
+            connection.execute(self.db.text(f'ALTER TABLE {self.messages.name} DROP COLUMN {name}'))
+        connection.execute(self.db.text(f'DROP TABLE IF EXISTS {self.PROGRESS_TABLE}'))
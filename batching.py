@@ -0,0 +1,56 @@
+class MessageBatcher:
+    """Groups chat messages per room into one messages_batch event per window.
+
+    The first message for a room starts a ``window`` second timer; everything
+    queued for that room until it fires, or until ``max_size`` messages are
+    waiting, goes out as a single emit, so busy rooms send clients one frame
+    and one payload encoding per batch instead of per message. ``send(room,
+    messages)`` does the emit, messages_batch to the room by default.
+    """
+
+    def __init__(self, socketio, window=0.01, max_size=50, send=None):
+        self.socketio = socketio
+        self.send = send or self._emit
+        self.window = window
+        self.max_size = max_size
+        self.pending = {}  # socket room -> list of message payloads
+        self.batches = 0
+        self.messages = 0
+
+    def add(self, room, message):
+        batch = self.pending.get(room)
+        if batch is None:
+            batch = self.pending[room] = []
+            self.socketio.start_background_task(self._flush_later, room, batch)
+        batch.append(message)
+        if len(batch) >= self.max_size:
+            self.flush(room)
+
+    def flush(self, room):
+        batch = self.pending.pop(room, None)
+        if not batch:
+            return
+        self.batches += 1
+        self.messages += len(batch)
+        self.send(room, batch)
+
+    def flush_all(self):
+        for room in list(self.pending):
+            self.flush(room)
+
+    def stats(self):
+        return {
+            'window': self.window,
+            'max_size': self.max_size,
+            'batches': self.batches,
+            'messages': self.messages,
+        }
+
+    def _emit(self, room, batch):
+        self.socketio.emit('messages_batch', {'room': room, 'messages': batch}, room=room)
+
+    def _flush_later(self, room, batch):
+        self.socketio.sleep(self.window)
+        # The batch may already have gone out because it filled up
+        if self.pending.get(room) is batch:
+            self.flush(room)
@@ -0,0 +1,101 @@
+"""Broadcast throughput of main.py workers sharing a Socket.IO message queue.
+
+Starts N copies of main.py on consecutive ports behind one message queue,
+connects clients to every worker, sends chat messages through the first worker
+and reports how many deliveries per second reach clients on all workers.
+
+    python benchmarks/broadcast_throughput.py --queue redis://localhost:6379/0 --workers 1 2 4
+
+Google login is bypassed with the benchmark routes from harness.py.
+Needs the Socket.IO client extras: pip install "python-socketio[client]"
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import socketio
+
+from harness import login_cookie, start_server, stop_server
+
+
+def connect_client(base_url, user_id, on_message):
+    client = socketio.Client()
+    client.on('message', on_message)
+    client.connect(base_url, headers={'Cookie': login_cookie(base_url, user_id)}, transports=['websocket'])
+    client.call('join', {'room_id': None})
+    return client
+
+
+def run(workers, clients_per_worker, messages, queue_url, base_port):
+    env = dict(os.environ)
+    env['message_queue_url'] = queue_url
+    env.setdefault('database_url', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+    procs = []
+    clients = []
+    received = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+    expected = messages * workers * clients_per_worker
+
+    def on_message(data):
+        with lock:
+            received[0] += 1
+            if received[0] >= expected:
+                done.set()
+
+    try:
+        # Start the first worker alone so it creates the schema before the others boot
+        for i in range(workers):
+            procs.append(start_server(base_port + i, env))
+
+        for i in range(workers):
+            for j in range(clients_per_worker):
+                clients.append(connect_client(f'http://127.0.0.1:{base_port + i}', f'bench-{i}-{j}', on_message))
+
+        sender = connect_client(f'http://127.0.0.1:{base_port}', 'bench-sender', lambda data: None)
+
+        start = time.perf_counter()
+        for n in range(messages):
+            sender.emit('message', {'room': None, 'message': f'bench {n}'})
+        done.wait(timeout=120)
+        elapsed = time.perf_counter() - start
+
+        sender.disconnect()
+        return {
+            'workers': workers,
+            'clients': workers * clients_per_worker,
+            'messages': messages,
+            'delivered': received[0],
+            'expected': expected,
+            'seconds': round(elapsed, 3),
+            'deliveries_per_sec': round(received[0] / elapsed, 1),
+        }
+    finally:
+        for client in clients:
+            client.disconnect()
+        for proc in procs:
+            stop_server(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queue', default=os.getenv('message_queue_url', 'redis://localhost:6379/0'))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=25, help='clients connected to each worker')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5100)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'clients':>8} {'delivered':>12} {'seconds':>8} {'deliveries/s':>14}")
+    for workers in args.workers:
+        result = run(workers, args.clients, args.messages, args.queue, args.port)
+        print(f"{result['workers']:>8} {result['clients']:>8} "
+              f"{result['delivered']:>6}/{result['expected']:<6} {result['seconds']:>8} "
+              f"{result['deliveries_per_sec']:>14}")
+
+
+if __name__ == '__main__':
+    main()
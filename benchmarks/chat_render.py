@@ -0,0 +1,131 @@
+"""Time to interactive and browser memory of the chat page on a room with a long history.
+
+Seeds a room with --messages messages, opens /chat in headless Chromium and
+reports how long the first page of messages takes to appear, then scrolls to
+the top until the whole history is loaded and reports the DOM size, the
+JavaScript heap and how long one timestamp refresh takes. Run it on two
+checkouts to compare them.
+
+Needs Playwright, which is not a dependency of the app:
+
+    pip install playwright && playwright install chromium
+    python benchmarks/chat_render.py --messages 50000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+from harness import login_cookie, start_server, stop_server
+
+# Counts the history requests in flight and remembers whether more pages exist
+TRACK_HISTORY = """
+window.__history = {pending: 0, hasMore: true, pages: 0};
+const originalFetch = window.fetch;
+window.fetch = (...args) => {
+    const history = String(args[0]).includes('/get_messages') && String(args[0]).includes('before_id');
+    if (!history) return originalFetch(...args);
+    window.__history.pending++;
+    return originalFetch(...args).then(response => {
+        response.clone().json().then(data => {
+            window.__history.hasMore = data.has_more;
+            window.__history.pages++;
+        }).finally(() => window.__history.pending--);
+        return response;
+    });
+};
+"""
+
+LOAD_ALL_HISTORY = """async () => {
+    const scroller = document.getElementById('messages').parentElement;
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+    while (window.__history.hasMore || window.__history.pending) {
+        if (!window.__history.pending) scroller.scrollTop = 0;
+        await sleep(10);
+    }
+    await sleep(100);
+    return window.__history.pages;
+}"""
+
+# The same work as the page's once-a-minute refresh, over every timestamp in the DOM
+TIMESTAMP_REFRESH = """() => {
+    const start = performance.now();
+    const stamps = document.querySelectorAll('#messages .timestamp');
+    stamps.forEach(el => {
+        const seconds = Math.floor((new Date() - new Date(el.dataset.timestamp)) / 1000);
+        el.textContent = seconds < 3600 ? `${Math.floor(seconds / 60)}m ago` : `${Math.floor(seconds / 3600)}h ago`;
+    });
+    document.body.offsetHeight;
+    return {count: stamps.length, ms: performance.now() - start};
+}"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--port', type=int, default=5071)
+    parser.add_argument('--page-size', type=int, default=200, help='messages per history request')
+    args = parser.parse_args()
+
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        sys.exit('Playwright is needed: pip install playwright && playwright install chromium')
+
+    env = dict(os.environ)
+    env['database_url'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'render.db')
+    env['message_page_size'] = str(args.page_size)
+    env['max_message_page_size'] = str(args.page_size)
+    base_url = f'http://127.0.0.1:{args.port}'
+    server = start_server(args.port, env)
+    try:
+        cookie = login_cookie(base_url, 'render-user')
+        room_id = requests.post(f'{base_url}/_bench/seed', json={
+            'name': 'long history', 'members': ['render-user'], 'history': args.messages,
+        }, headers={'Cookie': cookie}).json()['id']
+
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch()
+            context = browser.new_context(viewport={'width': 1280, 'height': 900})
+            context.add_cookies([{'name': name, 'value': value, 'url': base_url}
+                                 for name, value in (part.split('=', 1) for part in cookie.split('; '))])
+            context.add_init_script(TRACK_HISTORY)
+            page = context.new_page()
+            cdp = context.new_cdp_session(page)
+            cdp.send('Performance.enable')
+
+            def browser_metrics():
+                cdp.send('HeapProfiler.collectGarbage')
+                values = {m['name']: m['value'] for m in cdp.send('Performance.getMetrics')['metrics']}
+                return {'dom_nodes': int(values['Nodes']), 'js_heap_mb': round(values['JSHeapUsedSize'] / 2**20, 1)}
+
+            page.goto(f'{base_url}/chat?room_id={room_id}')
+            page.wait_for_selector('#messages .message')
+            interactive = page.evaluate("""() => ({
+                dom_interactive_ms: performance.getEntriesByType('navigation')[0].domInteractive,
+                first_messages_ms: performance.now(),
+            })""")
+            report = {'messages': args.messages, 'first_page': dict(interactive, **browser_metrics())}
+
+            start = time.perf_counter()
+            pages = page.evaluate(LOAD_ALL_HISTORY)
+            report['full_history'] = dict(
+                browser_metrics(),
+                history_requests=pages,
+                load_seconds=round(time.perf_counter() - start, 1),
+                message_elements=page.evaluate("document.querySelectorAll('#messages .message').length"),
+                timestamp_refresh=page.evaluate(TIMESTAMP_REFRESH),
+            )
+            browser.close()
+    finally:
+        stop_server(server)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
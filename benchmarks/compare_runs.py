@@ -0,0 +1,48 @@
+"""Compare two JSON reports written by load_test.py --output.
+
+    python benchmarks/compare_runs.py before.json after.json
+"""
+import argparse
+import json
+
+
+def flatten(report, prefix=''):
+    # Numeric leaves keyed by dotted path; history entries are keyed by size
+    values = {}
+    if isinstance(report, dict):
+        for key, value in report.items():
+            if key in ('config', 'started_at', 'database'):
+                continue
+            values.update(flatten(value, f'{prefix}{key}.'))
+    elif isinstance(report, list):
+        for entry in report:
+            size = entry.get('history')
+            values.update(flatten({k: v for k, v in entry.items() if k != 'history'}, f'{prefix}{size}.'))
+    elif isinstance(report, (int, float)):
+        values[prefix.rstrip('.')] = report
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = flatten(json.load(f))
+    with open(args.after) as f:
+        after = flatten(json.load(f))
+
+    width = max(len(key) for key in before)
+    print(f"{'metric':<{width}} {'before':>12} {'after':>12} {'change':>9}")
+    for key, old in before.items():
+        new = after.get(key)
+        if new is None:
+            continue
+        change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+        print(f'{key:<{width}} {old:>12} {new:>12} {change:>9}')
+
+
+if __name__ == '__main__':
+    main()
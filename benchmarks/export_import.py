@@ -0,0 +1,134 @@
+"""Throughput and peak memory of /export_messages and the import-messages command.
+
+Seeds one room with --rows messages, streams it out of a running server over
+HTTP into an NDJSON file, then loads that file into a second, empty database
+with ``flask import-messages``. Peak resident memory of the server and of the
+import process is read from /proc, so both should stay flat as --rows grows.
+
+    python benchmarks/export_import.py --rows 3000000
+    python benchmarks/export_import.py --database-url postgresql://localhost/src --target-url postgresql://localhost/dst
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from harness import ROOT, RATE_LIMITS_OFF, login_cookie, start_server, stop_server
+
+
+def peak_rss_mb(pid):
+    # VmHWM is the process's high-water mark of resident memory
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def export_room(base_url, cookie, room_id, path):
+    start = time.perf_counter()
+    rows = 0
+    with requests.get(f'{base_url}/export_messages/{room_id}', headers={'Cookie': cookie},
+                      stream=True, timeout=600) as response, open(path, 'wb') as f:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            f.write(line + b'\n')
+            rows += 1
+    return rows, time.perf_counter() - start
+
+
+CREATE_TARGET_ROOM = """
+import main
+main.create_app()
+with main.app.app_context():
+    main.User.save(main.User(id='bench-export', name='bench-export', email='bench-export@bench.local'))
+    room = main.Room(name='import bench', created_by='bench-export')
+    main.db.session.add(room)
+    main.db.session.commit()
+    print(room.id)
+"""
+
+
+def import_file(path, env):
+    # Create the schema and a room to load into, then time the command alone
+    output = subprocess.run([sys.executable, '-c', CREATE_TARGET_ROOM], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    room_id = output.strip().splitlines()[-1]
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'main', 'import-messages', path,
+                             '--room-id', room_id],
+                            cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    peak = None
+    while proc.poll() is None:
+        peak = peak_rss_mb(proc.pid) or peak
+        time.sleep(0.1)
+    output = proc.stdout.read().strip().splitlines()[-1]
+    if proc.returncode:
+        raise RuntimeError(f'import-messages failed: {output}')
+    return output, time.perf_counter() - start, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--port', type=int, default=5300)
+    parser.add_argument('--database-url', default=None, help='source database, defaults to a fresh SQLite file')
+    parser.add_argument('--target-url', default=None, help='import database, defaults to a fresh SQLite file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    env = dict(RATE_LIMITS_OFF, **os.environ)
+    env['database_url'] = args.database_url or 'sqlite:///' + os.path.join(workdir, 'source.db')
+    base_url = f'http://127.0.0.1:{args.port}'
+    path = os.path.join(workdir, 'export.ndjson')
+
+    server = start_server(args.port, env)
+    try:
+        start = time.perf_counter()
+        response = requests.post(f'{base_url}/_bench/seed', json={
+            'name': 'export bench', 'members': ['bench-export'], 'history': args.rows
+        }, timeout=3600)
+        response.raise_for_status()
+        seed_seconds = time.perf_counter() - start
+        room_id = response.json()['id']
+
+        before = peak_rss_mb(server.pid)
+        rows, export_seconds = export_room(base_url, login_cookie(base_url, 'bench-export'), room_id, path)
+        server_peak = peak_rss_mb(server.pid)
+    finally:
+        stop_server(server)
+
+    target_env = dict(env, database_url=args.target_url or 'sqlite:///' + os.path.join(workdir, 'target.db'))
+    output, import_seconds, import_peak = import_file(path, target_env)
+
+    print(json.dumps({
+        'rows': args.rows,
+        'seed_seconds': round(seed_seconds, 1),
+        'export': {
+            'rows': rows,
+            'seconds': round(export_seconds, 2),
+            'rows_per_sec': round(rows / export_seconds, 1),
+            'file_mb': round(os.path.getsize(path) / 1024 / 1024, 1),
+            # Seeding happens in the same server, so compare with the peak before exporting
+            'server_peak_rss_mb_before': before,
+            'server_peak_rss_mb_after': server_peak,
+        },
+        'import': {
+            'seconds': round(import_seconds, 2),
+            'rows_per_sec': round(rows / import_seconds, 1),
+            'peak_rss_mb': import_peak,
+            'output': output,
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Shared helpers for the benchmark scripts.
+
+Boots main.py in a child process with two benchmark-only routes so clients can
+skip the Google OAuth flow in authorized():
+
+    GET  /_bench/login/<user_id>   create the user if needed and log in as them
+    POST /_bench/seed              create a room with members and N messages of history
+"""
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks push far more traffic per user than the default rate limits allow
+RATE_LIMITS_OFF = {
+    'rate_limit_message_user': '0',
+    'rate_limit_message_room': '0',
+    'rate_limit_join_user': '0',
+    'rate_limit_join_room': '0',
+    'rate_limit_create_room_user': '0',
+    'rate_limit_get_messages_user': '0',
+    'rate_limit_export_user': '0',
+    'rate_limit_search_user': '0',
+    'rate_limit_mark_read_user': '0',
+    'rate_limit_profiles_user': '0',
+}
+
+
+def install_bench_routes(main):
+    from flask import jsonify, request
+    from flask_login import login_user
+
+    def ensure_user(user_id):
+        user = main.db.session.get(main.User, user_id)
+        if not user:
+            user = main.User(id=user_id, name=user_id, email=f'{user_id}@bench.local')
+            main.User.save(user)
+        return user
+
+    @main.app.route('/_bench/login/<user_id>')
+    def bench_login(user_id):
+        login_user(ensure_user(user_id))
+        return 'ok'
+
+    @main.app.route('/_bench/seed', methods=['POST'])
+    def bench_seed():
+        spec = request.get_json()
+        members = spec.get('members', [])
+        for user_id in members:
+            ensure_user(user_id)
+
+        room = main.Room(name=spec['name'], is_private=spec.get('is_private', False), created_by=members[0])
+        if room.is_private:
+            room.generate_invite_code()
+        main.db.session.add(room)
+        main.db.session.flush()
+        for user_id in members:
+            main.db.session.add(main.RoomMember(room_id=room.id, user_id=user_id))
+        main.db.session.commit()
+
+        # History is bulk inserted in chunks, oldest first, one second apart
+        history = spec.get('history', 0)
+        start = datetime.now(timezone.utc) - timedelta(seconds=history)
+        for offset in range(0, history, 5000):
+            main.db.session.execute(main.Message.__table__.insert(), [{
+                'user_id': members[0],
+                'room': room.id,
+                'message': f'history message {n}',
+                'created_at': start + timedelta(seconds=n),
+            } for n in range(offset, min(offset + 5000, history))])
+            main.db.session.commit()
+
+        return jsonify({'id': room.id})
+
+
+def serve(port):
+    # Entry point of the child process; settings come from the environment
+    sys.path.insert(0, ROOT)
+    import main
+
+    main.create_app()
+    install_bench_routes(main)
+    main.socketio.run(main.app, host='127.0.0.1', port=port, log_output=False)
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not start')
+
+
+def start_server(port, env=None):
+    env = dict(RATE_LIMITS_OFF, **(env or os.environ))
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(f'http://127.0.0.1:{port}/')
+    except RuntimeError:
+        proc.terminate()
+        raise
+    return proc
+
+
+def stop_server(proc):
+    proc.terminate()
+    proc.wait()
+
+
+def login_cookie(base_url, user_id):
+    http = requests.Session()
+    http.get(f'{base_url}/_bench/login/{user_id}')
+    return '; '.join(f'{k}={v}' for k, v in http.cookies.items())
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]))
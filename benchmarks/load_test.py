@@ -0,0 +1,219 @@
+"""Load test for the Socket.IO and HTTP paths of main.py.
+
+Boots main.py (SQLite by default, or --database-url for a local Postgres) with
+login stubbed by harness.py, then runs these phases and prints one JSON report:
+
+  join      connect --clients simulated clients spread over public chat and
+            --rooms public/private rooms, and measure joins/sec
+  messages  --senders clients each send --messages messages; every receiver
+            records fan-out latency, reported as percentiles with messages/sec
+  history   /chat and /get_messages latency for rooms with growing history
+  leave     every client leaves its room and disconnects; leaves/sec
+
+    python benchmarks/load_test.py --clients 2000 --output run.json
+    python benchmarks/compare_runs.py before.json after.json
+
+Needs: pip install "python-socketio[asyncio_client]" aiohttp
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+import requests
+import socketio
+
+from harness import start_server, stop_server
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'p50_ms': pick(0.50),
+        'p90_ms': pick(0.90),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+class SimulatedClient:
+    def __init__(self, base_url, user_id, room_id):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.room_id = room_id
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.latencies = []
+        self.sio.on('message', self.on_message)
+        self.sio.on('messages_batch', self.on_batch)
+
+    def on_message(self, data):
+        # Senders put their send time in the text: "bench <epoch seconds>"
+        text = data.get('message', '')
+        if text.startswith('bench '):
+            self.latencies.append(time.time() - float(text.split()[1]))
+
+    def on_batch(self, data):
+        for message in data.get('messages', []):
+            self.on_message(message)
+
+    async def connect(self, http):
+        async with http.get(f'{self.base_url}/_bench/login/{self.user_id}') as response:
+            await response.read()
+            cookie = '; '.join(f'{k}={v.value}' for k, v in response.cookies.items())
+        await self.sio.connect(self.base_url, headers={'Cookie': cookie}, transports=['websocket'])
+
+    async def join(self):
+        return await self.sio.call('join', {'room_id': self.room_id}, timeout=60)
+
+    async def send(self):
+        return await self.sio.call('message', {'room': self.room_id, 'message': f'bench {time.time()}'}, timeout=60)
+
+    async def leave(self):
+        await self.sio.emit('leave', {'room_id': self.room_id})
+        await self.sio.disconnect()
+
+
+def seed_room(base_url, name, members, is_private=False, history=0):
+    response = requests.post(f'{base_url}/_bench/seed', json={
+        'name': name, 'members': members, 'is_private': is_private, 'history': history
+    }, timeout=600)
+    response.raise_for_status()
+    return response.json()['id']
+
+
+async def gather_limited(coroutines, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(c) for c in coroutines))
+
+
+async def run_socket_phases(base_url, args, room_ids):
+    # Clients are spread round-robin over public chat (None) and the seeded rooms
+    targets = [None] + room_ids
+    clients = [SimulatedClient(base_url, f'load-{n}', targets[n % len(targets)]) for n in range(args.clients)]
+    report = {}
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar()) as http:
+        await gather_limited((client.connect(http) for client in clients), args.concurrency)
+
+    start = time.perf_counter()
+    results = await gather_limited((client.join() for client in clients), args.concurrency)
+    elapsed = time.perf_counter() - start
+    report['join'] = {
+        'clients': len(clients),
+        'failed': sum(1 for result in results if not result or result.get('error')),
+        'seconds': round(elapsed, 3),
+        'joins_per_sec': round(len(clients) / elapsed, 1),
+    }
+
+    senders = clients[:args.senders]
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        await asyncio.gather(*(sender.send() for sender in senders))
+    send_elapsed = time.perf_counter() - start
+    await asyncio.sleep(args.settle)
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    sent = len(senders) * args.messages
+    report['messages'] = {
+        'sent': sent,
+        'delivered': len(latencies),
+        'seconds': round(send_elapsed, 3),
+        'messages_per_sec': round(sent / send_elapsed, 1),
+        'deliveries_per_sec': round(len(latencies) / (send_elapsed + args.settle), 1),
+        'fanout_latency': percentiles(latencies),
+    }
+
+    start = time.perf_counter()
+    await gather_limited((client.leave() for client in clients), args.concurrency)
+    elapsed = time.perf_counter() - start
+    report['leave'] = {
+        'clients': len(clients),
+        'seconds': round(elapsed, 3),
+        'leaves_per_sec': round(len(clients) / elapsed, 1),
+    }
+    return report
+
+
+def measure_history(base_url, sizes, samples):
+    http = requests.Session()
+    http.get(f'{base_url}/_bench/login/load-history')
+    results = []
+    for size in sizes:
+        room_id = seed_room(base_url, f'history {size}', ['load-history'], history=size)
+        timings = {'chat': [], 'get_messages': []}
+        for _ in range(samples):
+            for name, path in (('chat', f'/chat?room_id={room_id}'), ('get_messages', f'/get_messages/{room_id}')):
+                start = time.perf_counter()
+                response = http.get(base_url + path)
+                timings[name].append(time.perf_counter() - start)
+                response.raise_for_status()
+        results.append({
+            'history': size,
+            'chat': percentiles(timings['chat']),
+            'get_messages': percentiles(timings['get_messages']),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None, help='defaults to a fresh SQLite file')
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--rooms', type=int, default=10, help='rooms besides public chat; every third is private')
+    parser.add_argument('--senders', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=20, help='messages per sender')
+    parser.add_argument('--concurrency', type=int, default=200, help='clients connecting/joining at once')
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds to wait for deliveries after sending')
+    parser.add_argument('--history', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--history-samples', type=int, default=20)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['database_url'] = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db')
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    server = start_server(args.port, env)
+    try:
+        # Every simulated user is a member of every room so private rooms admit them
+        members = [f'load-{n}' for n in range(args.clients)]
+        room_ids = [seed_room(base_url, f'load room {n}', members, is_private=(n % 3 == 0))
+                    for n in range(args.rooms)]
+
+        report = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': 'sqlite' if env['database_url'].startswith('sqlite') else env['database_url'].split(':')[0],
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'database_url')},
+        }
+        report.update(asyncio.run(run_socket_phases(base_url, args, room_ids)))
+        report['history'] = measure_history(base_url, args.history, args.history_samples)
+    finally:
+        stop_server(server)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Messages/sec through handle_message with synchronous and write-behind persistence.
+
+Each mode runs in a fresh process against the given database, sends messages
+through the Socket.IO test client and reports how fast they were acknowledged
+and how fast they were durably stored.
+
+    python benchmarks/message_persistence.py --messages 5000
+    python benchmarks/message_persistence.py --database-url postgresql://localhost/square_chat_bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import RATE_LIMITS_OFF
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(messages):
+    # Runs inside a child process configured through the environment
+    sys.path.insert(0, ROOT)
+    import main
+
+    main.create_app()
+    with main.app.app_context():
+        if not main.db.session.get(main.User, 'bench-user'):
+            main.User.save(main.User(id='bench-user', name='Bench', email='bench@bench.local'))
+        before = main.Message.query.count()
+
+    http = main.app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = 'bench-user'
+    client = main.socketio.test_client(main.app, flask_test_client=http)
+    client.emit('join', {'room_id': None}, callback=True)
+
+    start = time.perf_counter()
+    for n in range(messages):
+        result = client.emit('message', {'room': None, 'message': f'bench {n}'}, callback=True)
+        if not result or result.get('error'):
+            raise RuntimeError(f'Message {n} failed: {result}')
+    acked = time.perf_counter() - start
+
+    if main.message_write_behind:
+        main.message_writer.stop()
+    stored = time.perf_counter() - start
+
+    with main.app.app_context():
+        written = main.Message.query.count() - before
+    client.disconnect()
+
+    print(json.dumps({
+        'mode': 'write-behind' if main.message_write_behind else 'synchronous',
+        'messages': messages,
+        'stored': written,
+        'acked_per_sec': round(messages / acked, 1),
+        'stored_per_sec': round(messages / stored, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--measure', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--database-url', default=None,
+                        help='defaults to a fresh SQLite file per mode')
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure)
+        return
+
+    for write_behind in ('false', 'true'):
+        env = dict(RATE_LIMITS_OFF, **os.environ)
+        env['message_write_behind'] = write_behind
+        env['database_url'] = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+        output = subprocess.run([sys.executable, __file__, '--measure', str(args.messages)],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['mode']:>13}: {result['acked_per_sec']:>9} acked/s  "
+              f"{result['stored_per_sec']:>9} stored/s  ({result['stored']}/{result['messages']} stored)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Query-count regression check for the /rooms page.
+
+Renders /rooms against a fresh SQLite database with a few rooms and with many
+rooms, counts the SQL statements each render issues and exits non-zero if the
+count grows with the number of rooms.
+
+    python benchmarks/rooms_queries.py --small 5 --large 300
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--small', type=int, default=5)
+    parser.add_argument('--large', type=int, default=300)
+    args = parser.parse_args()
+
+    os.environ['database_url'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    sys.path.insert(0, ROOT)
+    import main
+    from sqlalchemy import event
+
+    main.create_app()
+
+    statements = []
+
+    with main.app.app_context():
+        event.listen(main.db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *rest: statements.append(statement))
+
+        main.User.save(main.User(id='bench-user', name='Bench', email='bench@bench.local'))
+        main.User.save(main.User(id='bench-other', name='Other', email='other@bench.local'))
+
+    http = main.app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = 'bench-user'
+
+    def add_rooms(count):
+        with main.app.app_context():
+            for n in range(count):
+                creator = 'bench-user' if n % 2 else 'bench-other'
+                room = main.Room(name=f'room {n}', is_private=bool(n % 3 == 0), created_by=creator)
+                if room.is_private:
+                    room.generate_invite_code()
+                main.db.session.add(room)
+                main.db.session.flush()
+                main.db.session.add(main.RoomMember(room_id=room.id, user_id='bench-user'))
+                main.db.session.add(main.RoomMember(room_id=room.id, user_id='bench-other'))
+            main.db.session.commit()
+
+    def count_queries():
+        statements.clear()
+        response = http.get('/rooms')
+        assert response.status_code == 200, response.status_code
+        return len(statements)
+
+    add_rooms(args.small)
+    # Warm the per-process caches (e.g. the user profile) so both counts compare like for like
+    count_queries()
+    small = count_queries()
+    add_rooms(args.large - args.small)
+    large = count_queries()
+
+    print(f'/rooms with {args.small} rooms: {small} queries')
+    print(f'/rooms with {args.large} rooms: {large} queries')
+    if large != small:
+        print('FAIL: query count depends on the number of rooms')
+        sys.exit(1)
+    print('OK: constant number of queries')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Latency of /search on a large synthetic corpus, with a LIKE scan for comparison.
+
+Fills a fresh database (SQLite by default, or --database-url) with --messages
+messages of random words drawn from a Zipf-like vocabulary, spread over public
+chat and a few rooms, then times /search for rare, common and multi-word
+queries through the Flask test client. Exits non-zero if any query type's p99
+is above --target-p99-ms.
+
+    python benchmarks/search_latency.py --messages 2000000
+    python benchmarks/search_latency.py --database-url postgresql://localhost/square_chat_bench
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from harness import RATE_LIMITS_OFF
+from load_test import percentiles
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VOCABULARY_SIZE = 20000
+
+
+def word(rank):
+    return f'w{rank}'
+
+
+def random_text(rng, words):
+    # Low ranks are common, high ranks rare
+    return ' '.join(word(int(rng.paretovariate(1.1)) % VOCABULARY_SIZE) for _ in range(words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--samples', type=int, default=50, help='searches per query type')
+    parser.add_argument('--target-p99-ms', type=float, default=200.0)
+    parser.add_argument('--database-url', default=None, help='defaults to a fresh SQLite file')
+    parser.add_argument('--skip-like', action='store_true', help='do not time the unindexed LIKE baseline')
+    args = parser.parse_args()
+
+    os.environ.update(RATE_LIMITS_OFF)
+    os.environ['database_url'] = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'search.db')
+    sys.path.insert(0, ROOT)
+    import main
+
+    main.create_app()
+    rng = random.Random(42)
+    with main.app.app_context():
+        main.User.save(main.User(id='bench-search', name='Bench', email='bench-search@bench.local'))
+        rooms = [main.Room(name=f'search room {n}', created_by='bench-search', is_private=(n % 2 == 0))
+                 for n in range(args.rooms)]
+        main.db.session.add_all(rooms)
+        main.db.session.flush()
+        # The searching user is a member of half of the private rooms
+        main.db.session.add_all(main.RoomMember(room_id=room.id, user_id='bench-search')
+                                for room in rooms[:args.rooms // 2])
+        main.db.session.commit()
+        targets = [None] + [room.id for room in rooms]
+
+        start = time.perf_counter()
+        for offset in range(0, args.messages, 10000):
+            main.db.session.execute(main.Message.__table__.insert(), [{
+                'user_id': 'bench-search',
+                'room': rng.choice(targets),
+                'message': random_text(rng, rng.randint(3, 20)),
+            } for _ in range(min(10000, args.messages - offset))])
+            main.db.session.commit()
+        seed_seconds = time.perf_counter() - start
+
+    http = main.app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = 'bench-search'
+
+    queries = {
+        'common': [word(rng.randint(1, 5)) for _ in range(args.samples)],
+        'rare': [word(rng.randint(5000, VOCABULARY_SIZE - 1)) for _ in range(args.samples)],
+        'two_words': [f'{word(rng.randint(1, 50))} {word(rng.randint(50, 500))}' for _ in range(args.samples)],
+    }
+
+    report = {'messages': args.messages, 'seed_seconds': round(seed_seconds, 1), 'search': {}}
+    failed = False
+    for name, texts in queries.items():
+        timings = []
+        for text in texts:
+            start = time.perf_counter()
+            response = http.get('/search', query_string={'q': text})
+            timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f'/search?q={text} returned {response.status_code}')
+        report['search'][name] = percentiles(timings)
+        failed = failed or report['search'][name]['p99_ms'] > args.target_p99_ms
+
+    if not args.skip_like:
+        # What a search without the index costs: a LIKE scan over every message
+        with main.app.app_context():
+            timings = []
+            for text in queries['rare'][:5]:
+                start = time.perf_counter()
+                main.Message.query.filter(main.Message.message.like(f'%{text}%'))\
+                    .order_by(main.Message.created_at.desc(), main.Message.id.desc()).limit(21).all()
+                timings.append(time.perf_counter() - start)
+        report['like_scan_rare'] = percentiles(timings)
+
+    print(json.dumps(report, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
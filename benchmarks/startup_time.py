@@ -0,0 +1,101 @@
+"""Cold start time of a worker process: import, create_app() and the first request.
+
+Every sample is a fresh interpreter, as when a worker boots. Three setups are
+timed: a worker with schema_auto_migrate off (how workers run once migrations
+are a deploy step), one that checks for pending migrations on an up-to-date
+database, and one that migrates a new, empty database.
+
+    python benchmarks/startup_time.py --workers 20
+    python benchmarks/startup_time.py --database-url postgresql://localhost/square_chat_bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import RATE_LIMITS_OFF
+from load_test import percentiles
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ('import', 'create_app', 'first_request')
+
+
+def measure():
+    # Runs inside the child process configured through the environment
+    sys.path.insert(0, ROOT)
+    timings = {}
+
+    start = time.perf_counter()
+    import main
+    timings['import'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main.create_app()
+    timings['create_app'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = main.app.test_client().get('/readyz')
+    timings['first_request'] = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f'/readyz returned {response.status_code}: {response.get_data(as_text=True)}')
+
+    print(json.dumps(timings))
+
+
+def boot(env):
+    # Wall time includes interpreter start-up, which is part of a worker's cold start
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, __file__, '--measure'], env=env, cwd=ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    wall = time.perf_counter() - start
+    return json.loads(output.strip().splitlines()[-1]), wall
+
+
+def run_setup(workers, env_for_sample):
+    samples = {phase: [] for phase in PHASES}
+    samples['total'] = []
+    for n in range(workers):
+        timings, wall = boot(env_for_sample(n))
+        for phase in PHASES:
+            samples[phase].append(timings[phase])
+        samples['total'].append(wall)
+    return {phase: percentiles(values) for phase, values in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, default=10, help='cold starts per setup')
+    parser.add_argument('--database-url', default=None, help='defaults to SQLite files in a temporary directory')
+    args = parser.parse_args()
+
+    if args.measure:
+        measure()
+        return
+
+    directory = tempfile.mkdtemp()
+    base = dict(RATE_LIMITS_OFF, **os.environ)
+    migrated_url = args.database_url or 'sqlite:///' + os.path.join(directory, 'migrated.db')
+
+    # Bring the shared database up to date once, as a deploy would
+    boot(dict(base, database_url=migrated_url, schema_auto_migrate='true'))
+
+    report = {'workers': args.workers, 'setups': {}}
+    report['setups']['no_migration_check'] = run_setup(
+        args.workers, lambda n: dict(base, database_url=migrated_url, schema_auto_migrate='false'))
+    report['setups']['migration_check'] = run_setup(
+        args.workers, lambda n: dict(base, database_url=migrated_url, schema_auto_migrate='true'))
+    if not args.database_url:
+        report['setups']['migrate_new_database'] = run_setup(
+            args.workers, lambda n: dict(base, schema_auto_migrate='true',
+                                         database_url='sqlite:///' + os.path.join(directory, f'new-{n}.db')))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
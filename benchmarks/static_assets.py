@@ -0,0 +1,105 @@
+"""Bytes and requests for the app's own static files per page load, before and after the asset build.
+
+Renders /, /rooms and /chat through the Flask test client with
+static_fingerprints off (files served as they are in static/) and on (the
+build from python assets.py), and fetches every /static/ URL on each page the
+way a browser would: a first visit downloads everything accepting gzip and
+brotli, a repeat visit skips what its Cache-Control allows it to reuse and
+revalidates the rest with If-None-Match. CDN scripts and styles are not counted.
+
+    python assets.py && python benchmarks/static_assets.py
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from harness import RATE_LIMITS_OFF
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ('/', '/rooms', '/chat')
+
+
+def reusable(cache_control):
+    # Whether a browser may reuse the response without asking the server again
+    return 'immutable' in cache_control or re.search(r'max-age=[1-9]', cache_control) is not None
+
+
+def measure():
+    # Runs inside the child process configured through the environment
+    sys.path.insert(0, ROOT)
+    import main
+
+    main.create_app()
+    with main.app.app_context():
+        main.User.save(main.User(id='bench-static', name='Bench', email='bench-static@bench.local'))
+
+    anonymous = main.app.test_client()
+    http = main.app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = 'bench-static'
+
+    report = {}
+    for page in PAGES:
+        # The landing page redirects signed-in users to the chat
+        html = (anonymous if page == '/' else http).get(page).get_data(as_text=True)
+        urls = sorted(set(re.findall(r'(?:href|src)="(/static/[^"]+)"', html)))
+
+        first = {'requests': 0, 'bytes': 0, 'css_js_bytes': 0}
+        repeat = {'requests': 0, 'bytes': 0}
+        for url in urls:
+            response = http.get(url, headers={'Accept-Encoding': 'gzip, deflate, br'})
+            first['requests'] += 1
+            first['bytes'] += len(response.data)
+            if url.endswith(('.css', '.js')):
+                first['css_js_bytes'] += len(response.data)
+
+            if reusable(response.headers.get('Cache-Control', '')):
+                continue
+            headers = {'Accept-Encoding': 'gzip, deflate, br'}
+            if response.headers.get('ETag'):
+                headers['If-None-Match'] = response.headers['ETag']
+            revalidated = http.get(url, headers=headers)
+            repeat['requests'] += 1
+            repeat['bytes'] += len(revalidated.data)
+
+        report[page] = {'assets': len(urls), 'first_visit': first, 'repeat_visit': repeat}
+    print(json.dumps(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure()
+        return
+
+    if not os.path.exists(os.path.join(ROOT, 'static', 'dist', 'manifest.json')):
+        sys.exit('Build the assets first: python assets.py')
+
+    report = {}
+    for name, fingerprints in (('before', 'false'), ('after', 'true')):
+        env = dict(RATE_LIMITS_OFF, **os.environ)
+        env['static_fingerprints'] = fingerprints
+        env['database_url'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'static.db')
+        output = subprocess.run([sys.executable, __file__, '--measure'], env=env, cwd=ROOT,
+                                check=True, capture_output=True, text=True).stdout
+        report[name] = json.loads(output.strip().splitlines()[-1])
+
+    print(json.dumps(report, indent=2))
+    for page in PAGES:
+        before, after = report['before'][page], report['after'][page]
+        print(f"{page:>7}: first visit CSS/JS {before['first_visit']['css_js_bytes']:>6} -> "
+              f"{after['first_visit']['css_js_bytes']:>6} bytes (all files {before['first_visit']['bytes']} -> "
+              f"{after['first_visit']['bytes']}), repeat visit {before['repeat_visit']['requests']} -> "
+              f"{after['repeat_visit']['requests']} requests")
+
+
+if __name__ == '__main__':
+    main()
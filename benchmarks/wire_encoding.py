@@ -0,0 +1,203 @@
+"""Bytes on the wire and server CPU per broadcast for JSON and compact chat messages.
+
+The offline part builds realistic message payloads (Google-style user ids and
+picture URLs) and, for single messages and batches, reports the size of the
+Socket.IO frames each recipient gets and the CPU the server spends building
+and encoding one broadcast (python-socketio encodes a broadcast once for all
+recipients). A MessagePack variant of the compact rows, sent as a binary
+attachment, is included for comparison when msgpack is installed.
+
+With --live it also starts main.py, connects --clients JSON or compact
+clients to public chat, sends --messages messages and reports the server
+process CPU time per broadcast and the bytes each client received:
+
+    python benchmarks/wire_encoding.py
+    python benchmarks/wire_encoding.py --live --clients 50 --messages 500
+
+The live part needs the Socket.IO client extras (pip install
+"python-socketio[client]") and reads CPU time from /proc, so Linux only.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from socketio import packet
+
+from harness import ROOT, login_cookie, start_server, stop_server
+
+sys.path.insert(0, ROOT)
+from wire import COMPACT_EVENT, compact_rows  # noqa: E402
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+WORDS = 'the a to and of is in it you that for on was with are this be have not but at what can so'.split()
+
+
+def sample_messages(count, senders=20, seed=1):
+    rng = random.Random(seed)
+    users = [{
+        'user_id': str(rng.randrange(10**20, 10**21)),
+        'name': f'{rng.choice(["Alex", "Sam", "Jordan", "Taylor"])} {rng.choice(["Smith", "Garcia", "Chen", "Okafor"])}',
+        'profile_img': 'https://lh3.googleusercontent.com/a/' + ''.join(rng.choices('ACDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz0123456789_-', k=78)) + '=s96-c',
+    } for _ in range(senders)]
+    start = datetime.now(timezone.utc)
+    return [dict(rng.choice(users),
+                 id=1000000 + n,
+                 message=' '.join(rng.choices(WORDS, k=rng.randint(2, 20))),
+                 room=None,
+                 created_at=(start + timedelta(milliseconds=n * 137)).isoformat())
+            for n in range(count)]
+
+
+def wire_bytes(event, data):
+    # Engine.IO frames one recipient gets: a text frame ('4' + packet), plus one per binary attachment
+    encoded = packet.Packet(packet.EVENT, data=[event, data], namespace='/').encode()
+    frames = encoded if isinstance(encoded, list) else [encoded]
+    return sum(len(frame) if isinstance(frame, bytes) else len(frame.encode()) + 1 for frame in frames), len(frames)
+
+
+def broadcasts(messages, batch):
+    # (event, data builder) per encoding for one broadcast of ``messages``
+    if batch == 1:
+        json_event = ('message', lambda: messages[0])
+    else:
+        json_event = ('messages_batch', lambda: {'room': 'public', 'messages': messages})
+    encodings = {
+        'json': json_event,
+        'compact': (COMPACT_EVENT, lambda: ['public', compact_rows(messages)]),
+    }
+    if msgpack is not None:
+        encodings['compact+msgpack'] = (COMPACT_EVENT, lambda: msgpack.packb(['public', compact_rows(messages)]))
+    return encodings
+
+
+def offline(batches, repeat):
+    report = {}
+    messages = sample_messages(max(batches) * 10)
+    for batch in batches:
+        chunks = [messages[n:n + batch] for n in range(0, batch * 10, batch)]
+        report[f'batch_{batch}'] = results = {}
+        for encoding in broadcasts(chunks[0], batch):
+            sizes = []
+            for chunk in chunks:
+                event, build = broadcasts(chunk, batch)[encoding]
+                sizes.append(wire_bytes(event, build()))
+            event, build = broadcasts(chunks[0], batch)[encoding]
+            seconds = min(timeit.repeat(
+                lambda: packet.Packet(packet.EVENT, data=[event, build()], namespace='/').encode(),
+                number=repeat, repeat=5)) / repeat
+            results[encoding] = {
+                'bytes_per_recipient': round(sum(size for size, _ in sizes) / len(sizes), 1),
+                'bytes_per_message': round(sum(size for size, _ in sizes) / len(sizes) / batch, 1),
+                'frames_per_recipient': sizes[0][1],
+                'encode_us_per_broadcast': round(seconds * 1e6, 2),
+            }
+    return report
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def live(setup, compact_enabled, client_encoding, clients, messages, port):
+    import socketio
+
+    env = dict(os.environ)
+    env['database_url'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'wire.db')
+    env['socket_compact_encoding'] = 'true' if compact_enabled else 'false'
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_server(port, env)
+    connected = []
+    received = {'messages': 0, 'bytes': 0}
+    lock = threading.Lock()
+    done = threading.Event()
+    expected = clients * messages
+
+    def connect(user_id, count_bytes):
+        client = socketio.Client()
+        auth = {'encoding': client_encoding}
+        if count_bytes:
+            receive = client.eio._receive_packet
+
+            def counting(pkt):
+                data = pkt.encode()
+                with lock:
+                    received['bytes'] += len(data) if isinstance(data, bytes) else len(data.encode())
+                return receive(pkt)
+            client.eio._receive_packet = counting
+
+            def delivered(data):
+                # A compact event is [room, rows]; a JSON message event is one message
+                with lock:
+                    received['messages'] += len(data[1]) if isinstance(data, list) else 1
+                    if received['messages'] >= expected:
+                        done.set()
+            client.on('message', delivered)
+            client.on(COMPACT_EVENT, delivered)
+        client.connect(base_url, headers={'Cookie': login_cookie(base_url, user_id)},
+                       transports=['websocket'], auth=auth)
+        client.call('join', {'room_id': None})
+        connected.append(client)
+        return client
+
+    try:
+        for n in range(clients):
+            connect(f'wire-{n}', True)
+        sender = connect('wire-sender', False)
+        time.sleep(1)
+        with lock:
+            received.update(bytes=0, messages=0)
+
+        cpu_start = cpu_seconds(server.pid)
+        for n in range(messages):
+            sender.call('message', {'room': None, 'message': ' '.join(random.choices(WORDS, k=10))})
+        done.wait(timeout=120)
+        cpu = cpu_seconds(server.pid) - cpu_start
+        return {
+            'setup': setup,
+            'clients': clients,
+            'messages': messages,
+            'delivered': received['messages'],
+            'server_cpu_ms_per_broadcast': round(cpu / messages * 1000, 3),
+            'bytes_per_client_per_message': round(received['bytes'] / max(received['messages'], 1), 1),
+        }
+    finally:
+        for client in connected:
+            client.disconnect()
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 20], help='messages per event')
+    parser.add_argument('--repeat', type=int, default=2000, help='encodes per timing')
+    parser.add_argument('--live', action='store_true', help='also measure a running server')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--port', type=int, default=5081)
+    args = parser.parse_args()
+
+    report = {'offline': offline(args.batches, args.repeat)}
+    if args.live:
+        report['live'] = [
+            live('compact off', False, 'json', args.clients, args.messages, args.port),
+            live('compact on, JSON clients', True, 'json', args.clients, args.messages, args.port + 1),
+            live('compact on, compact clients', True, 'compact', args.clients, args.messages, args.port + 2),
+        ]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,56 @@
 import os
+import sys
+import atexit
+import signal
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Message queue listeners block on their sockets, and the production server runs
+# every connection in a green thread, so under eventlet the standard library has
+# to be patched before anything else imports it
+if os.getenv("message_queue_url") or os.getenv("server_mode") == "production":
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+        try:
+            # Let other green threads run while psycopg2 waits on PostgreSQL
+            from eventlet.support import psycopg2_patcher
+            psycopg2_patcher.make_psycopg_green()
+        except ImportError:
+            pass
+    except ImportError:
+        pass
+
 from datetime import datetime, timezone
-from flask import Flask, redirect, url_for, render_template, jsonify, session, request
+from flask import Flask, redirect, url_for, render_template, jsonify, session, request, g, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import SocketIO, ConnectionRefusedError, join_room, leave_room
 from authlib.integrations.flask_client import OAuth
-from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
 import secrets
 import string
-
-# Load environment variables from .env file
-load_dotenv()
+from presence import create_presence_store, CountBroadcaster
+from write_behind import MessageWriter, WriterBusy
+from message_cache import RecentMessages
+from ttl_cache import TTLCache
+from metrics import Registry, instrument_pool
+from batching import MessageBatcher
+from rate_limit import create_rate_limiter, parse_limit
+from user_cache import UserCache, CachedUser
+from message_io import export_lines, read_lines, MessageImporter
+from retention import RetentionJob
+from partitions import MessagePartitions
+from search import MessageSearch, highlight_html
+from unread import UnreadCounters
+from serve import ProductionServer
+from migrations import SchemaMigrator, Migration, add_missing_columns, create_indexes
+from assets import StaticAssets
+from wire import MessageWire
+from author_backfill import AuthorBackfill, has_author_columns
+import click
 
 # Fetch OAuth credentials and DB URL from environment variables
 google_oauth_client_id = os.getenv("google_oauth_client_id")
@@ -18,6 +58,77 @@ google_oauth_client_secret = os.getenv("google_oauth_client_secret")
 database_url = os.getenv("database_url")
 secret_key = os.getenv("secret_key")
 
+# Optional Socket.IO message queue shared by every worker so room broadcasts reach
+# clients connected to any process or host: redis://host:6379/0 for Redis,
+# memory:// for an in-process queue in tests (needs kombu), unset for a single process
+message_queue_url = os.getenv("message_queue_url")
+message_queue_channel = os.getenv("message_queue_channel", "square-chat")
+
+# Presence (who is online in each room): redis:// shares it across workers and
+# defaults to the message queue's Redis; otherwise it is kept in-process
+presence_url = os.getenv("presence_url") or message_queue_url
+presence_ttl = int(os.getenv("presence_ttl", 120))
+
+# member_count updates are coalesced per room over this many seconds (0 sends each one)
+member_count_window = float(os.getenv("member_count_window", 0.25))
+
+# Optional outbound batching: chat messages for a room are sent as one
+# messages_batch event per window (0 sends every message on its own)
+message_batch_window_ms = float(os.getenv("message_batch_window_ms", 0))
+message_batch_max = int(os.getenv("message_batch_max", 50))
+
+# Let clients that ask for it at connect receive chat messages as compact arrays
+# (sender ids, epoch-ms timestamps) instead of JSON objects; see wire.py
+socket_compact_encoding = os.getenv("socket_compact_encoding", "false").lower() in ('1', 'true', 'yes')
+max_profiles_per_request = int(os.getenv("max_profiles_per_request", 100))
+
+# Token-bucket rate limits as "<count>/<seconds>" ("0" disables a limit).
+# Buckets live in Redis when rate_limit_url (or the presence Redis) is set.
+# The per-room join limit must let a whole drained or restarted worker's clients
+# rejoin a busy room at once; clients retry rejected joins after retry_after
+rate_limit_url = os.getenv("rate_limit_url") or presence_url
+rate_limits = {
+    ('message', 'user'): parse_limit(os.getenv("rate_limit_message_user", "10/5")),
+    ('message', 'room'): parse_limit(os.getenv("rate_limit_message_room", "100/1")),
+    ('join', 'user'): parse_limit(os.getenv("rate_limit_join_user", "20/10")),
+    ('join', 'room'): parse_limit(os.getenv("rate_limit_join_room", "5000/5")),
+    ('create_room', 'user'): parse_limit(os.getenv("rate_limit_create_room_user", "5/60")),
+    ('get_messages', 'user'): parse_limit(os.getenv("rate_limit_get_messages_user", "30/10")),
+    ('export', 'user'): parse_limit(os.getenv("rate_limit_export_user", "2/60")),
+    ('search', 'user'): parse_limit(os.getenv("rate_limit_search_user", "20/10")),
+    ('mark_read', 'user'): parse_limit(os.getenv("rate_limit_mark_read_user", "30/10")),
+    ('profiles', 'user'): parse_limit(os.getenv("rate_limit_profiles_user", "30/10")),
+}
+
+# How python main.py serves: "development" runs the debug server with the reloader,
+# "production" runs eventlet's WSGI server with server_workers processes listening
+# on server_port, server_port + 1, ... (put a sticky-session load balancer in front)
+server_mode = os.getenv("server_mode", "development")
+server_host = os.getenv("server_host", "0.0.0.0")
+server_port = int(os.getenv("server_port", 5000))
+server_workers = int(os.getenv("server_workers", 1))
+
+# Concurrent connections per worker (each WebSocket holds one); more wait to be accepted
+server_max_connections = int(os.getenv("server_max_connections", 1000))
+
+# On SIGTERM a worker stops accepting, flushes queued messages and asks clients to
+# reconnect within server_reconnect_within seconds; stragglers are cut off after
+# server_drain_seconds (keep it below the orchestrator's stop timeout)
+server_drain_seconds = float(os.getenv("server_drain_seconds", 10))
+server_reconnect_within = float(os.getenv("server_reconnect_within", 5))
+
+# Engine.IO heartbeat: a client that does not answer a ping within ping_timeout
+# seconds of ping_interval is dropped, freeing its connection slot
+socket_ping_interval = float(os.getenv("socket_ping_interval", 25))
+socket_ping_timeout = float(os.getenv("socket_ping_timeout", 20))
+
+# Database connections per worker. Only requests that query take one, so the pool is
+# a fraction of server_max_connections; keep server_workers * (db_pool_size +
+# db_max_overflow) below PostgreSQL's max_connections
+db_pool_size = int(os.getenv("db_pool_size", min(max(server_max_connections // 100, 5), 20)))
+db_max_overflow = int(os.getenv("db_max_overflow", db_pool_size))
+db_pool_timeout = float(os.getenv("db_pool_timeout", 10))
+
 # App setup
 app = Flask(__name__)
 
@@ -30,11 +141,127 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,        # Check if connection is alive before using it
     'pool_recycle': 280,          # Recycle connections after 280 seconds
 }
+if database_url and not database_url.startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': db_pool_size,
+        'max_overflow': db_max_overflow,
+        'pool_timeout': db_pool_timeout,
+    })
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Initialize SQLAlchemy and SocketIO
+# Message history pagination (newest page rendered by /chat, older pages fetched on demand)
+message_page_size = int(os.getenv("message_page_size", 50))
+max_message_page_size = int(os.getenv("max_message_page_size", 200))
+
+# Messages replayed to a client that rejoins after a disconnect; after a longer gap
+# (or more than max_message_page_size) it is told to reload the newest page instead
+max_replay_messages = int(os.getenv("max_replay_messages", 200))
+
+# Write-behind message persistence: broadcast first, insert in background batches
+message_write_behind = os.getenv("message_write_behind", "false").lower() in ('1', 'true', 'yes')
+message_batch_size = int(os.getenv("message_batch_size", 500))
+message_max_pending = int(os.getenv("message_max_pending", 10000))
+message_flush_interval = float(os.getenv("message_flush_interval", 0.05))
+message_id_block_size = int(os.getenv("message_id_block_size", 1000))
+
+# Per-room buffer of the newest messages so opening a room skips the database.
+# Each worker only sees the messages sent through it, so the buffer is off when
+# a message queue spreads rooms over several workers
+recent_messages_size = int(os.getenv("recent_messages_size", 100))
+recent_messages_max_bytes = int(os.getenv("recent_messages_max_mb", 64)) * 1024 * 1024
+recent_messages_enabled = recent_messages_size > 0 and not message_queue_url
+
+# Rows read from the database per round trip while streaming an export
+export_chunk_size = int(os.getenv("export_chunk_size", 1000))
+
+# Message retention: rooms keep messages for their own retention_days, or this many
+# days when unset (0 keeps them forever). Expired messages are appended to gzipped
+# NDJSON files under message_archive_dir (empty to delete without archiving)
+message_retention_days = int(os.getenv("message_retention_days", 0))
+message_archive_dir = os.getenv("message_archive_dir", "data/archive")
+retention_batch_size = int(os.getenv("retention_batch_size", 1000))
+retention_interval = int(os.getenv("retention_interval", 3600))
+
+# PostgreSQL only: partition messages by created_at month, creating partitions
+# this many months ahead. Existing tables are converted with flask partition-messages
+message_partitioning = os.getenv("message_partitioning", "false").lower() in ('1', 'true', 'yes')
+partition_months_ahead = int(os.getenv("partition_months_ahead", 2))
+
+# Full-text search: text search configuration on PostgreSQL (e.g. simple, english)
+# and results per /search page
+search_language = os.getenv("search_language", "simple")
+search_page_size = int(os.getenv("search_page_size", 20))
+max_search_page_size = int(os.getenv("max_search_page_size", 100))
+
+# Serve the minified, fingerprinted CSS/JS built by python assets.py (with immutable
+# caching and precompressed copies). Off by default in development so edits show up
+static_fingerprints = os.getenv("static_fingerprints", "true" if server_mode == "production" else "false").lower() in ('1', 'true', 'yes')
+
+# Apply pending schema migrations when the app starts (create_app). With several
+# hosts, turn it off and run flask --app main migrate once per deploy instead
+schema_auto_migrate = os.getenv("schema_auto_migrate", "true").lower() in ('1', 'true', 'yes')
+
+# Messages read per transaction when moving sender names and pictures out of
+# the messages table (flask backfill-message-authors, and migration 5 on SQLite)
+author_backfill_batch_size = int(os.getenv("author_backfill_batch_size", 5000))
+
+# Number of public rooms shown per page on /rooms
+rooms_page_size = int(os.getenv("rooms_page_size", 30))
+
+# Cached (room, user) membership answers. Invalidation only reaches this worker,
+# so with several workers a removed member can keep access for up to the TTL
+membership_cache_ttl = int(os.getenv("membership_cache_ttl", 30))
+membership_cache_size = int(os.getenv("membership_cache_size", 100000))
+
+# Cached user profiles so loading current_user skips the users table. Entries
+# are also shared through Redis when user_cache_url (or the presence Redis) is set;
+# a profile change reaches other workers' local copies within user_cache_ttl seconds
+user_cache_url = os.getenv("user_cache_url") or presence_url
+user_cache_ttl = int(os.getenv("user_cache_ttl", 60))
+user_cache_shared_ttl = int(os.getenv("user_cache_shared_ttl", 3600))
+user_cache_size = int(os.getenv("user_cache_size", 50000))
+
+# Initialize SQLAlchemy and SocketIO; create_app() sets to True once it has run
 db = SQLAlchemy(app)
-socketio = SocketIO(app)
+app_ready = False
+user_cache = UserCache(user_cache_url, max_size=user_cache_size, ttl=user_cache_ttl,
+                       shared_ttl=user_cache_shared_ttl)
+socketio = SocketIO(app, message_queue=message_queue_url, channel=message_queue_channel,
+                    ping_interval=socket_ping_interval, ping_timeout=socket_ping_timeout)
+static_assets = StaticAssets(app, os.path.join(app.static_folder, 'dist', 'manifest.json'),
+                             enabled=static_fingerprints)
+
+# Metrics served in the Prometheus text format at /metrics
+metrics = Registry()
+http_request_seconds = metrics.histogram(
+    'square_chat_http_request_seconds', 'HTTP request latency by endpoint', labels=('endpoint',))
+message_handle_seconds = metrics.histogram(
+    'square_chat_message_handle_seconds', 'Total time spent in handle_message')
+message_db_seconds = metrics.histogram(
+    'square_chat_message_db_seconds', 'Time handle_message spends persisting (commit or write-behind queue)')
+message_emit_seconds = metrics.histogram(
+    'square_chat_message_emit_seconds', 'Time handle_message spends broadcasting')
+messages_total = metrics.counter(
+    'square_chat_messages_total', 'Chat messages sent', labels=('room_type',))
+socket_connects_total = metrics.counter(
+    'square_chat_socket_connects_total', 'Accepted Socket.IO connections')
+socket_disconnects_total = metrics.counter(
+    'square_chat_socket_disconnects_total', 'Socket.IO disconnections')
+connected_sockets = metrics.gauge(
+    'square_chat_connected_sockets', 'Socket.IO connections open on this worker')
+db_pool_checkout_seconds = metrics.histogram(
+    'square_chat_db_pool_checkout_seconds', 'Time spent waiting for a database connection from the pool')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_start' in g:
+        http_request_seconds.observe(time.perf_counter() - g.request_start,
+                                     endpoint=request.endpoint or 'unknown')
+    return response
 
 # Define database models
 class User(db.Model, UserMixin):
@@ -59,6 +286,7 @@ class User(db.Model, UserMixin):
         else:
             db.session.add(user)
         db.session.commit()
+        user_cache.delete(user.id)
 
 class Room(db.Model):
     __tablename__ = 'rooms'
@@ -70,9 +298,16 @@ class Room(db.Model):
     invite_code = db.Column(db.String(32), unique=True)  # Store unique invite code
     created_by = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    retention_days = db.Column(db.Integer)  # None uses message_retention_days, 0 keeps forever
+    message_count = db.Column(db.BigInteger, default=0)  # Messages ever stored, for unread counts
     creator = db.relationship('User', backref='created_rooms', foreign_keys=[created_by])
     members = db.relationship('User', secondary='room_members', backref='rooms')
 
+    # /rooms lists one kind of room newest first, a page at a time
+    __table_args__ = (
+        db.Index('ix_rooms_is_private_created_at_id', 'is_private', 'created_at', 'id'),
+    )
+
     def generate_invite_code(self):
         # Generate a random 8-character code
         alphabet = string.ascii_letters + string.digits
@@ -87,6 +322,7 @@ class Room(db.Model):
             'invite_code': self.invite_code,
             'created_by': self.created_by,
             'created_at': self.created_at.isoformat(),
+            'retention_days': self.retention_days,
             'creator': {
                 'id': self.creator.id,
                 'name': self.creator.name,
@@ -101,62 +337,187 @@ class RoomMember(db.Model):
     user_id = db.Column(db.String(128), db.ForeignKey('users.id'), primary_key=True)
     joined_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # The primary key covers room -> members; this covers user -> rooms
+    __table_args__ = (
+        db.Index('ix_room_members_user_id', 'user_id'),
+    )
+
+class ReadMarker(db.Model):
+    __tablename__ = 'read_markers'
+
+    user_id = db.Column(db.String(128), db.ForeignKey('users.id'), primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'), primary_key=True)
+    read_seq = db.Column(db.BigInteger, nullable=False, default=0)  # Room.message_count read up to
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
 class Message(db.Model):
     __tablename__ = 'messages'
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(128), db.ForeignKey('users.id'), nullable=False)
     room = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=True)
-    name = db.Column(db.String(128), nullable=False)
     message = db.Column(db.Text, nullable=False)
-    profile_img = db.Column(db.String(256))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     user = db.relationship('User', backref=db.backref('messages', lazy=True))
     room_rel = db.relationship('Room', backref=db.backref('messages', lazy=True))
 
+    # Keyset pagination walks (room, created_at, id) so history pages are index range scans
+    __table_args__ = (
+        db.Index('ix_messages_room_created_at_id', 'room', 'created_at', 'id'),
+    )
+
     def to_dict(self):
+        # The sender's name and picture come from message_authors(), once per page
         return {
             'id': self.id,
-            'name': self.name,
+            'user_id': self.user_id,
             'message': self.message,
-            'profile_img': self.profile_img,
             'room_id': self.room,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
-# Create database tables if they don't exist
-with app.app_context():
-    try:
-        # Create tables if they don't exist
-        db.create_all()
-        print("Database tables initialized successfully")
-
-        # Verify tables exist
-        inspector = db.inspect(db.engine)
-        tables = inspector.get_table_names()
-        print(f"Existing tables: {tables}")
-
-        # Verify database setup
-        def verify_database_setup():
-            print("\n=== Database Verification ===")
-            try:
-                # Get all table names using inspector
-                inspector = db.inspect(db.engine)
-                tables = inspector.get_table_names()
-                print("Available tables:", tables)
-                print("===========================\n")
-
-            except Exception as e:
-                print(f"Error during database verification: {str(e)}")
-                print("===========================\n")
-
-        # Call this after db.create_all()
-        verify_database_setup()
-
-    except Exception as e:
-        print(f"Error initializing database: {str(e)}")
-        raise e
+message_wire = MessageWire(socketio, compact_enabled=socket_compact_encoding)
+message_batcher = MessageBatcher(socketio, window=message_batch_window_ms / 1000, max_size=message_batch_max,
+                                 send=lambda room, batch: message_wire.send(room, batch, batched=True))
+
+rate_limiter = create_rate_limiter(rate_limit_url, rate_limits)
+
+unread_counters = UnreadCounters(db, Room, ReadMarker, Message, socketio)
+
+def throttled_socket_event(action, room=None):
+    # Error ack for a socket event over its limit, or None when it may proceed
+    wait = rate_limiter.check(action, user_id=current_user.id, room=room)
+    if wait:
+        return {'error': 'Rate limit exceeded', 'retry_after': round(wait, 2)}
+    return None
+
+def throttled_request(action):
+    # 429 response for an HTTP request over its limit, or None when it may proceed
+    wait = rate_limiter.check(action, user_id=current_user.id)
+    if wait:
+        response = jsonify({'error': 'Rate limit exceeded', 'retry_after': round(wait, 2)})
+        response.headers['Retry-After'] = str(max(int(wait + 0.999), 1))
+        return response, 429
+    return None
+
+# Background writer used when message_write_behind is enabled
+message_writer = MessageWriter(app, db, Message, socketio,
+                               batch_size=message_batch_size,
+                               max_pending=message_max_pending,
+                               flush_interval=message_flush_interval,
+                               block_size=message_id_block_size,
+                               before_commit=unread_counters.bump,
+                               after_commit=unread_counters.publish,
+                               on_dropped=lambda row: recent_messages.discard(row['room']))
+if message_write_behind:
+    atexit.register(message_writer.stop)
+
+recent_messages = RecentMessages(size=recent_messages_size, max_bytes=recent_messages_max_bytes)
+
+message_partitions = MessagePartitions(db, Message.__table__, months_ahead=partition_months_ahead)
+
+message_search = MessageSearch(db, Message.__table__, language=search_language)
+
+retention_job = RetentionJob(app, db, Message.__table__, Room.__table__, User.__table__, socketio,
+                             default_days=message_retention_days,
+                             archive_dir=message_archive_dir or None,
+                             batch_size=retention_batch_size,
+                             interval=retention_interval,
+                             on_deleted=recent_messages.discard,
+                             partitions=message_partitions if message_partitioning else None)
+
+def flush_pending_messages():
+    # Send batched broadcasts and store write-behind messages before the worker stops
+    message_batcher.flush_all()
+    if message_write_behind:
+        message_writer.flush()
+
+def reset_after_fork():
+    # Pooled connections opened while starting up belong to the parent process
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+production_server = ProductionServer(app, socketio, host=server_host, port=server_port,
+                                     workers=server_workers,
+                                     max_connections=server_max_connections,
+                                     drain_seconds=server_drain_seconds,
+                                     reconnect_within=server_reconnect_within,
+                                     on_fork=reset_after_fork,
+                                     on_drain=flush_pending_messages,
+                                     connected=lambda: len(socketio.server.eio.sockets))
+
+def create_tables(connection):
+    # A partitioned messages table has to exist before create_all() makes a plain one
+    if message_partitioning and connection.dialect.name == 'postgresql':
+        if not db.inspect(connection).has_table(Message.__tablename__):
+            message_partitions.create_table(connection)
+    db.metadata.create_all(bind=connection)
+
+def create_hot_query_indexes(connection):
+    # History pages, the /rooms listing and "rooms I belong to" lookups
+    for table in (Message.__table__, Room.__table__, RoomMember.__table__):
+        create_indexes(connection, table)
+
+def relax_message_authors(connection):
+    # Expand step: this version stops writing messages.name and messages.profile_img
+    # while workers of the previous one still write them, so name may no longer be
+    # NOT NULL. The columns are dropped later, once no old worker is left
+    # (flask backfill-message-authors --drop-columns)
+    if not has_author_columns(db, connection, Message.__tablename__):
+        return
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.text(f'ALTER TABLE {Message.__tablename__} ALTER COLUMN name DROP NOT NULL'))
+    else:
+        # SQLite cannot drop NOT NULL in place, and its one host has no old workers
+        # left once this runs, so the columns are moved and dropped right away
+        backfill = AuthorBackfill(db, User.__table__, Message.__tablename__, batch_size=author_backfill_batch_size)
+        backfill.run(connection)
+        backfill.finish(connection)
+
+# Schema versions, applied by flask migrate (or on start with schema_auto_migrate).
+# Append new steps; never edit or renumber applied ones
+schema_migrator = SchemaMigrator(db, [
+    Migration(1, 'create tables', create_tables),
+    Migration(2, 'add rooms.retention_days and rooms.message_count',
+              lambda connection: add_missing_columns(db, connection, Room.__table__,
+                                                     ['retention_days', 'message_count'])),
+    Migration(3, 'add indexes for history, room listing and membership queries', create_hot_query_indexes),
+    Migration(4, 'add the full-text search index', message_search.setup),
+    Migration(5, 'stop requiring message sender names and pictures', relax_message_authors),
+])
+
+def migrate_database():
+    applied = schema_migrator.migrate()
+    if message_partitioning and db.engine.dialect.name == 'postgresql':
+        message_partitions.maintain()
+        with db.engine.connect() as connection:
+            if not message_partitions.is_partitioned(connection):
+                print("messages is not partitioned yet; stop writers and run: flask --app main partition-messages")
+    elif message_partitioning:
+        print("message_partitioning needs PostgreSQL, ignoring it")
+    return applied
+
+def create_app():
+    """Finish setting the app up for serving and return it.
+
+    Importing this module touches neither the database nor Redis; this runs the
+    pending migrations when schema_auto_migrate is on and instruments the
+    connection pool. python main.py calls it once before forking workers, and
+    WSGI servers can load main:create_app() instead of main:app.
+    """
+    global app_ready
+    if not app_ready:
+        with app.app_context():
+            if schema_auto_migrate:
+                try:
+                    migrate_database()
+                except Exception as e:
+                    print(f"Error migrating database: {str(e)}")
+                    raise e
+            instrument_pool(db.engine, db_pool_checkout_seconds)
+        app_ready = True
+    return app
 
 # Google OAuth Setup
 oauth = OAuth(app)
@@ -171,14 +532,274 @@ google = oauth.register(
     server_metadata_url='https://accounts.google.com/.well-known/openid-configuration'
 )
 
+def fetch_message_page(room_id, before_id=None, after_id=None, limit=None):
+    """Return one page of a room's history (oldest first) and whether more pages exist.
+
+    Pages are keyset-paginated on (created_at, id): ``before_id`` walks back into
+    older history, ``after_id`` walks forward, and neither returns the newest page.
+    """
+    limit = min(max(int(limit or message_page_size), 1), max_message_page_size)
+    if before_id is not None or after_id is not None:
+        return query_message_page(room_id, before_id, after_id, limit)
+
+    if recent_messages_enabled:
+        cached = recent_messages.get(room_id, limit)
+        if cached is not None:
+            return cached
+
+    # Taken before the read, so a row the flusher commits meanwhile is in one or the other
+    queued = message_writer.queued() if message_write_behind else []
+
+    # Messages sent during the read are recorded, so the seeded buffer does not miss them
+    with recent_messages.recording(room_id) as appended:
+        message_dicts, has_more = query_message_page(room_id, None, None, limit)
+
+        # Include messages that were broadcast but not flushed yet
+        stored_ids = {message['id'] for message in message_dicts}
+        pending = [Message(**row).to_dict() for row in queued
+                   if row['room'] == room_id and row['id'] not in stored_ids]
+        if pending:
+            message_dicts += pending
+            has_more = has_more or len(message_dicts) > limit
+            message_dicts = message_dicts[-limit:]
+
+        if recent_messages_enabled:
+            recent_messages.seed(room_id, message_dicts, has_more, appended)
+
+    return message_dicts, has_more
+
+def query_message_page(room_id, before_id, after_id, limit):
+    # The database part of fetch_message_page(): one keyset page, oldest first
+    query = Message.query.filter(Message.room.is_(None) if room_id is None else Message.room == room_id)
+
+    cursor_id = before_id if before_id is not None else after_id
+    if cursor_id is not None:
+        cursor = db.session.query(Message.created_at, Message.id).filter(
+            Message.id == cursor_id,
+            Message.room.is_(None) if room_id is None else Message.room == room_id
+        ).first()
+        if not cursor:
+            return [], False
+
+        if before_id is not None:
+            query = query.filter(db.or_(
+                Message.created_at < cursor.created_at,
+                db.and_(Message.created_at == cursor.created_at, Message.id < cursor.id)
+            ))
+        else:
+            query = query.filter(db.or_(
+                Message.created_at > cursor.created_at,
+                db.and_(Message.created_at == cursor.created_at, Message.id > cursor.id)
+            ))
+
+    if after_id is not None:
+        rows = query.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+
+    return [message.to_dict() for message in rows], has_more
+
+def fetch_missed_messages(room_id, since_id):
+    """Return (messages, complete): what was sent in a room after ``since_id``, oldest first.
+
+    Served from the recent-message buffer when it reaches back to ``since_id``
+    and from a keyset query otherwise, so the cost follows the gap rather than
+    the history. ``complete`` is False when the gap is over max_replay_messages
+    or ``since_id`` is unknown (e.g. expired), and the client should refetch.
+    """
+    if recent_messages_enabled:
+        missed = recent_messages.since(room_id, since_id)
+        if missed is not None:
+            return (missed, True) if len(missed) <= max_replay_messages else ([], False)
+
+    # Messages broadcast but not flushed yet are not in the database
+    pending = [row for row in message_writer.queued() if row['room'] == room_id] if message_write_behind else []
+
+    if any(row['id'] == since_id for row in pending):
+        missed = []
+    else:
+        missed, has_more = fetch_message_page(room_id, after_id=since_id, limit=max_replay_messages)
+        if has_more:
+            return [], False
+        if not missed and not db.session.query(Message.query.filter(
+                Message.id == since_id,
+                Message.room.is_(None) if room_id is None else Message.room == room_id).exists()).scalar():
+            return [], False
+
+    stored_ids = {message['id'] for message in missed}
+    missed += [Message(**row).to_dict() for row in pending if row['id'] > since_id and row['id'] not in stored_ids]
+    if len(missed) > max_replay_messages:
+        return [], False
+    return missed, True
+
+def replay_result(room_id, data):
+    # Join ack, with the missed messages when the client says what it saw last
+    try:
+        since_id = int(data['since_id']) if data.get('since_id') is not None else None
+    except (ValueError, TypeError):
+        since_id = None
+    if since_id is None:
+        return {'success': True}
+
+    missed, complete = fetch_missed_messages(room_id, since_id)
+    return {'success': True, 'missed': missed, 'users': message_authors(missed), 'refetch': not complete}
+
+def list_rooms(is_private, member_id=None, search=None, offset=0, limit=None, reader_id=None):
+    """Return rooms with ``member_count`` set, using one query whatever the number of rooms.
+
+    Member counts come from a grouped room_members subquery and creators are
+    joined in the same statement, so neither the template nor to_dict() lazy loads.
+    With ``reader_id`` each room also gets ``unread`` from that user's read
+    marker (None for rooms they have never opened).
+    """
+    member_counts = db.session.query(
+        RoomMember.room_id,
+        db.func.count(RoomMember.user_id).label('member_count')
+    ).group_by(RoomMember.room_id).subquery()
+
+    unread = (db.func.coalesce(Room.message_count, 0) - ReadMarker.read_seq) if reader_id else db.null()
+    query = db.session.query(Room, db.func.coalesce(member_counts.c.member_count, 0), unread)\
+        .outerjoin(member_counts, member_counts.c.room_id == Room.id)\
+        .options(db.joinedload(Room.creator))\
+        .filter(Room.is_private == is_private)
+
+    if reader_id:
+        query = query.outerjoin(ReadMarker, db.and_(ReadMarker.room_id == Room.id, ReadMarker.user_id == reader_id))
+
+    if member_id is not None:
+        query = query.filter(Room.id.in_(
+            db.session.query(RoomMember.room_id).filter(RoomMember.user_id == member_id)
+        ))
+
+    if search:
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(db.or_(
+            Room.name.ilike(pattern, escape='\\'),
+            Room.description.ilike(pattern, escape='\\')
+        ))
+
+    query = query.order_by(Room.created_at.desc(), Room.id.desc())
+    if limit is not None:
+        query = query.offset(offset).limit(limit)
+
+    rooms = []
+    for room, count, unread_count in query.all():
+        room.member_count = count
+        room.unread = unread_count
+        rooms.append(room)
+    return rooms
+
+membership_cache = TTLCache(max_size=membership_cache_size, ttl=membership_cache_ttl)
+
+def is_room_member(room_id, user_id):
+    # Primary-key existence lookup on room_members instead of loading room.members
+    key = (room_id, user_id)
+    allowed = membership_cache.get(key)
+    if allowed is None:
+        allowed = db.session.query(
+            RoomMember.query.filter_by(room_id=room_id, user_id=user_id).exists()
+        ).scalar()
+        membership_cache.set(key, allowed)
+    return allowed
+
+def invalidate_membership(room_id, user_id):
+    membership_cache.delete((room_id, user_id))
+
+# Rooms are never deleted or made public/private later, so is_private is cached per room
+room_privacy_cache = TTLCache(max_size=membership_cache_size, ttl=membership_cache_ttl)
+
+def room_is_private(room_id):
+    # True or False, or None if there is no such room
+    is_private = room_privacy_cache.get(room_id)
+    if is_private is None:
+        room = db.session.query(Room.is_private).filter(Room.id == room_id).first()
+        if room is None:
+            return None
+        is_private = bool(room.is_private)
+        room_privacy_cache.set(room_id, is_private)
+    return is_private
+
+def can_post(room_id, user_id):
+    # Whether the room exists and the user may send to it (public chat is room None)
+    if room_id is None:
+        return True
+    is_private = room_is_private(room_id)
+    if is_private is None:
+        return False
+    return not is_private or is_room_member(room_id, user_id)
+
+def parse_retention_days(value):
+    # None or "" falls back to message_retention_days, 0 keeps messages forever
+    if value is None or value == '':
+        return None
+    days = int(value)
+    if days < 0 or days != float(value):
+        raise ValueError(value)
+    return days
+
+def parse_message_cursor(name):
+    # Read an optional integer cursor from the query string
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    return int(value)
+
 # Flask-Login setup to handle user sessions
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'home'
 
+def user_profile(user):
+    # Cacheable copy of a user, with the default picture resolved once
+    avatar = user.profile_img
+    if not avatar or not isinstance(avatar, str) or not avatar.startswith(('http', '/')):
+        avatar = url_for('static', filename='img/default-profile.png')
+    return {
+        'id': user.id,
+        'name': user.name,
+        'email': user.email,
+        'profile_img': user.profile_img,
+        'avatar': avatar
+    }
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, user_id)
+    profile = user_cache.get(user_id)
+    if profile is None:
+        user = db.session.get(User, user_id)
+        if not user:
+            return None
+        profile = user_profile(user)
+        user_cache.set(user_id, profile)
+    return CachedUser(**profile)
+
+def message_authors(messages):
+    """Return {user_id: {name, profile_img}} for the senders of ``messages``.
+
+    History responses send this once next to the messages instead of repeating
+    the sender in every message, so names and pictures are always the current
+    ones. Profiles come from the user cache; the rest from one query.
+    """
+    authors = {}
+    missing = []
+    for user_id in {message['user_id'] for message in messages}:
+        profile = user_cache.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            authors[user_id] = {'name': profile['name'], 'profile_img': profile['avatar']}
+
+    if missing:
+        for user in User.query.filter(User.id.in_(missing)).all():
+            profile = user_profile(user)
+            user_cache.set(user.id, profile)
+            authors[user.id] = {'name': profile['name'], 'profile_img': profile['avatar']}
+    return authors
 
 # Routes
 @app.route('/')
@@ -229,6 +850,7 @@ def authorized():
         profile_img=profile_img
     )
     User.save(user)
+    user_cache.set(user.id, user_profile(user))
     login_user(user)
 
     # Get the stored next URL from session
@@ -252,51 +874,61 @@ def chat():
     if room_id:
         try:
             room_id = int(room_id)
-            room = db.session.get(Room, room_id)
+            room = db.session.get(Room, room_id, options=[db.joinedload(Room.creator)])
             if not room:
                 return redirect(url_for('rooms'))
 
             # Check if user is member of private room
-            if room.is_private and current_user not in room.members:
+            if room.is_private and not is_room_member(room.id, current_user.id):
                 return redirect(url_for('rooms'))
 
-            # Fetch messages for specific room
-            messages = db.session.query(Message).filter_by(room=room_id).order_by(Message.created_at.asc()).all()
-            message_dicts = [message.to_dict() for message in messages]
+            # Fetch the newest page of messages for specific room
+            message_dicts, has_more = fetch_message_page(room_id)
 
-            # Get room data with members
+            # Only private rooms show their members, and member_snapshot keeps the list
+            # current, so large public rooms skip loading them
             room_data = room.to_dict()
             room_data['members'] = [{
                 'id': member.id,
                 'name': member.name,
                 'profile_img': member.profile_img
-            } for member in room.members]
+            } for member in room.members] if room.is_private else []
 
             return render_template('chat.html',
                                 user=current_user,
                                 messages=message_dicts,
+                                authors=message_authors(message_dicts),
+                                has_more=has_more,
                                 room=room_data)
         except (ValueError, TypeError):
             return redirect(url_for('rooms'))
     else:
-        # Fetch public messages (where room_id is None)
-        messages = db.session.query(Message).filter_by(room=None).order_by(Message.created_at.asc()).all()
-        message_dicts = [message.to_dict() for message in messages]
+        # Fetch the newest page of public messages (where room_id is None)
+        message_dicts, has_more = fetch_message_page(None)
 
         return render_template('chat.html',
                             user=current_user,
-                            messages=message_dicts)
+                            messages=message_dicts,
+                            authors=message_authors(message_dicts),
+                            has_more=has_more)
 
 @app.route('/rooms')
 @login_required
 def rooms():
-    # Get all public rooms
-    public_rooms = db.session.query(Room).filter_by(is_private=False).all()
+    search = request.args.get('q', '').strip()
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    # Get one page of public rooms; one extra row tells whether a next page exists
+    public_rooms = list_rooms(False, search=search, reader_id=current_user.id,
+                              offset=(page - 1) * rooms_page_size, limit=rooms_page_size + 1)
+    has_next = len(public_rooms) > rooms_page_size
+    public_rooms = public_rooms[:rooms_page_size]
 
     # Get private rooms where user is a member
-    private_rooms = db.session.query(Room).filter_by(is_private=True).filter(
-        Room.members.any(id=current_user.id)
-    ).all()
+    private_rooms = list_rooms(True, member_id=current_user.id, reader_id=current_user.id)
 
     # For each private room, add a flag indicating if the user is a member
     for room in private_rooms:
@@ -306,6 +938,9 @@ def rooms():
     return render_template('rooms.html',
                          public_rooms=public_rooms,
                          private_rooms=private_rooms,
+                         search=search,
+                         page=page,
+                         has_next=has_next,
                          user=current_user,
                          name=current_user.name,
                          profile_img=current_user.profile_img)
@@ -316,6 +951,10 @@ def create_room():
     if request.method == 'GET':
         return render_template('create_room.html', user=current_user)
 
+    limited = throttled_request('create_room')
+    if limited:
+        return limited
+
     try:
         data = request.get_json()
         if not data:
@@ -325,10 +964,16 @@ def create_room():
         if not data.get('name'):
             return jsonify({'error': 'Room name is required'}), 400
 
+        try:
+            retention_days = parse_retention_days(data.get('retention_days'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'retention_days must be a whole number of days'}), 400
+
         room = Room(
             name=data.get('name'),
             description=data.get('description', ''),
-            is_private=data.get('is_private', False)
+            is_private=data.get('is_private', False),
+            retention_days=retention_days
         )
 
         # Generate invite code for private rooms
@@ -340,8 +985,10 @@ def create_room():
         db.session.flush()  # This ensures room.id is available
 
         # Add creator as member
-        room.members.append(current_user)
+        db.session.add(RoomMember(room_id=room.id, user_id=current_user.id))
+        db.session.add(ReadMarker(user_id=current_user.id, room_id=room.id, read_seq=0))
         db.session.commit()
+        invalidate_membership(room.id, current_user.id)
 
         # Return room data with creator info
         room_data = room.to_dict()
@@ -364,10 +1011,17 @@ def join_by_invite(invite_code):
         if not room.is_private:
             return render_template('invalid_invite.html', user=current_user)
 
-        # Add user to room members if not already a member
-        if current_user not in room.members:
-            room.members.append(current_user)
+        # Add user to room members if not already a member (checked against the
+        # database, not a possibly stale cached answer)
+        invalidate_membership(room.id, current_user.id)
+        if not is_room_member(room.id, current_user.id):
+            db.session.add(RoomMember(room_id=room.id, user_id=current_user.id))
             db.session.commit()
+            invalidate_membership(room.id, current_user.id)
+
+            # Earlier history does not count as unread for a new member
+            unread_counters.mark_read(current_user.id, room.id)
+            emit_member_delta('member_added', room.id, {'member': member_payload(current_user)})
 
         # Redirect to the specific room's chat
         return redirect(url_for('chat', room_id=room.id))
@@ -377,12 +1031,70 @@ def join_by_invite(invite_code):
         return render_template('invalid_invite.html', user=current_user)
 
 # Track connected users in each room
-connected_users = {}
+presence = create_presence_store(presence_url, ttl=presence_ttl)
+presence_sweeper_started = False
+
+member_count_broadcaster = CountBroadcaster(socketio, presence, window=member_count_window)
+
+def member_payload(user):
+    return {
+        'id': user.id,
+        'name': user.name,
+        'profile_img': user.profile_img
+    }
+
+def emit_member_delta(event, room_id, payload):
+    # Every delta bumps the room's member list version; a client that sees a gap
+    # in versions asks for a fresh snapshot with member_snapshot. Only private
+    # rooms show a member list, so other rooms get no deltas
+    if not room_is_private(room_id):
+        return
+    payload['room_id'] = room_id
+    payload['version'] = presence.bump_version(str(room_id))
+    socketio.emit(event, payload, room=str(room_id))
+
+def emit_presence_changed(room_key, user_id, online):
+    if room_key != 'public':
+        emit_member_delta('presence_changed', int(room_key), {'user_id': user_id, 'online': online})
+
+def socket_connected(sid):
+    # Whether a Socket.IO sid still has an Engine.IO connection on this worker
+    eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+    return eio_sid is not None and eio_sid in socketio.server.eio.sockets
+
+def presence_sweeper():
+    # Heartbeat this worker's live connections and drop the rest, including ones left
+    # behind by dead workers or by disconnects that were never handled
+    while True:
+        socketio.sleep(max(presence_ttl // 3, 1))
+        try:
+            presence.refresh(socket_connected)
+            for room_key, _ in presence.expire():
+                member_count_broadcaster.schedule(room_key)
+        except Exception as e:
+            print(f"Error sweeping presence: {str(e)}")
 
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
+    global presence_sweeper_started
     if not current_user.is_authenticated:
         return False
+    if production_server.draining:
+        # Clients retry after a delay, by then on another worker
+        raise ConnectionRefusedError('draining')
+    if not presence_sweeper_started:
+        presence_sweeper_started = True
+        socketio.start_background_task(presence_sweeper)
+        retention_job.start()
+    socket_connects_total.inc()
+    connected_sockets.inc()
+    message_wire.connected(request.sid, auth)
+
+    # Only pages that show unread badges (rooms.js) ask for unread_update,
+    # for every room the user tracks
+    if isinstance(auth, dict) and auth.get('unread'):
+        for room_id in unread_counters.marked_rooms(current_user.id):
+            join_room(unread_counters.channel(room_id))
     return True
 
 @socketio.on('join')
@@ -392,17 +1104,17 @@ def on_join(data):
 
     room_id = data.get('room_id')
 
+    limited = throttled_socket_event('join', room=str(room_id) if room_id else 'public')
+    if limited:
+        return limited
+
     # Handle public chat (no room_id)
     if not room_id:
-        join_room('public')
-        if 'public' not in connected_users:
-            connected_users['public'] = set()
-        connected_users['public'].add(current_user.id)
-        emit('member_count', {
-            'room_id': 'public',
-            'count': len(connected_users['public'])
-        }, room='public')
-        return {'success': True}
+        for socket_room in message_wire.rooms('public', request.sid):
+            join_room(socket_room)
+        presence.join('public', current_user.id, request.sid)
+        member_count_broadcaster.schedule('public')
+        return replay_result(None, data)
 
     # Handle private rooms
     try:
@@ -412,33 +1124,23 @@ def on_join(data):
         if not room:
             return {'error': 'Room not found'}
 
-        if room.is_private and current_user not in room.members:
+        if room.is_private and not is_room_member(room.id, current_user.id):
             return {'error': 'Access denied'}
 
-        join_room(str(room_id))
-        if room_id not in connected_users:
-            connected_users[room_id] = set()
-        connected_users[room_id].add(current_user.id)
+        for socket_room in message_wire.rooms(str(room_id), request.sid):
+            join_room(socket_room)
+        was_online = presence.user_in_room(str(room_id), current_user.id)
 
         # Emit member count update
-        emit('member_count', {
-            'room_id': room_id,
-            'count': len(connected_users[room_id])
-        }, room=str(room_id))
+        presence.join(str(room_id), current_user.id, request.sid)
+        member_count_broadcaster.schedule(str(room_id))
 
-        # Emit member list update
-        member_list = [{
-            'id': member.id,
-            'name': member.name,
-            'profile_img': member.profile_img
-        } for member in room.members]
+        # Only the first tab of a user changes what other members see
+        if not was_online:
+            emit_presence_changed(str(room_id), current_user.id, True)
 
-        emit('member_list_update', {
-            'room_id': room_id,
-            'members': member_list
-        }, room=str(room_id))
-
-        return {'success': True}
+        # Joined before reading, so anything sent meanwhile arrives either way (clients drop duplicates)
+        return replay_result(room_id, data)
 
     except (ValueError, TypeError):
         return {'error': 'Invalid room ID'}
@@ -455,59 +1157,126 @@ def on_leave(data):
     if room_id:
         try:
             room_id = int(room_id)
-            leave_room(str(room_id))
-            if room_id in connected_users:
-                connected_users[room_id].discard(current_user.id)
-
-                # Emit member count update
-                emit('member_count', {
-                    'room_id': room_id,
-                    'count': len(connected_users[room_id])
-                }, room=str(room_id))
-
-                # Get room and emit member list update
-                room = Room.query.get(room_id)
-                if room:
-                    member_list = [{
-                        'id': member.id,
-                        'name': member.name,
-                        'profile_img': member.profile_img
-                    } for member in room.members]
-
-                    emit('member_list_update', {
-                        'room_id': room_id,
-                        'members': member_list
-                    }, room=str(room_id))
+            for socket_room in message_wire.rooms(str(room_id), request.sid):
+                leave_room(socket_room)
+
+            # Emit member count update
+            presence.leave(str(room_id), current_user.id, request.sid)
+            member_count_broadcaster.schedule(str(room_id))
+
+            if not presence.user_in_room(str(room_id), current_user.id):
+                emit_presence_changed(str(room_id), current_user.id, False)
 
         except (ValueError, TypeError):
             pass
     else:
-        leave_room('public')
-        if 'public' in connected_users:
-            connected_users['public'].discard(current_user.id)
-            emit('member_count', {
-                'room_id': 'public',
-                'count': len(connected_users['public'])
-            }, room='public')
+        for socket_room in message_wire.rooms('public', request.sid):
+            leave_room(socket_room)
+        presence.leave('public', current_user.id, request.sid)
+        member_count_broadcaster.schedule('public')
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    if current_user.is_authenticated:
-        # Remove from all rooms
-        for room_id, users in connected_users.items():
-            if current_user.id in users:
-                users.discard(current_user.id)
-                emit('member_count', {
-                    'room_id': room_id,
-                    'count': len(users)
-                }, room=str(room_id))
-        leave_room('public')
-        if 'public' in connected_users:
-            connected_users['public'].discard(current_user.id)
-            emit('member_count', {
-                'room_id': 'public',
-                'count': len(connected_users['public'])
-            }, room='public')
+    socket_disconnects_total.inc()
+    connected_sockets.dec()
+    message_wire.disconnected(request.sid)
+
+    # Only the rooms this connection joined are touched
+    user_id = current_user.id if current_user.is_authenticated else None
+    for room_key, _ in presence.disconnect(request.sid):
+        member_count_broadcaster.schedule(room_key)
+        if user_id and not presence.user_in_room(room_key, user_id):
+            emit_presence_changed(room_key, user_id, False)
+
+@socketio.on('mark_read')
+def mark_read(data):
+    # Move the user's read marker to message_id (or the newest message) in a room
+    if not current_user.is_authenticated:
+        return {'error': 'User not authenticated'}
+
+    limited = throttled_socket_event('mark_read')
+    if limited:
+        return limited
+
+    try:
+        room_id = int(data.get('room_id'))
+        message_id = data.get('message_id')
+        message_id = int(message_id) if message_id is not None else None
+    except (ValueError, TypeError):
+        return {'error': 'Invalid room ID'}
+
+    room = db.session.get(Room, room_id)
+    if not room:
+        return {'error': 'Room not found'}
+
+    if room.is_private and not is_room_member(room.id, current_user.id):
+        return {'error': 'Access denied'}
+
+    try:
+        pending = message_writer.queued() if message_write_behind else ()
+        read_seq = unread_counters.mark_read(current_user.id, room_id, message_id, pending=pending)
+    except Exception as e:
+        print(f"Error marking room read: {str(e)}")
+        db.session.rollback()
+        return {'error': 'Server error'}
+
+    return {'room_id': room_id, 'read_seq': read_seq}
+
+@socketio.on('member_snapshot')
+def member_snapshot(data):
+    # Full member list for clients that just joined or missed a delta
+    if not current_user.is_authenticated:
+        return {'error': 'User not authenticated'}
+
+    try:
+        room_id = int(data.get('room_id'))
+    except (ValueError, TypeError):
+        return {'error': 'Invalid room ID'}
+
+    room = db.session.get(Room, room_id)
+    if not room:
+        return {'error': 'Room not found'}
+
+    if not room.is_private:
+        return {'error': 'Room has no member list'}
+
+    if not is_room_member(room.id, current_user.id):
+        return {'error': 'Access denied'}
+
+    # Read the version first so any delta racing with this snapshot is re-applied
+    version = presence.version(str(room_id))
+    members = db.session.query(User.id, User.name, User.profile_img)\
+        .join(RoomMember, RoomMember.user_id == User.id)\
+        .filter(RoomMember.room_id == room_id)\
+        .all()
+
+    return {
+        'room_id': room_id,
+        'version': version,
+        'members': [member_payload(member) for member in members],
+        'online': presence.online_users(str(room_id))
+    }
+
+@socketio.on('profiles')
+def profiles(data):
+    # Names and pictures of the senders in compact messages; clients ask once per sender
+    if not current_user.is_authenticated:
+        return {'error': 'User not authenticated'}
+
+    limited = throttled_socket_event('profiles')
+    if limited:
+        return limited
+
+    user_ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(user_ids, list):
+        return {'error': 'Invalid user IDs'}
+
+    found = {}
+    for user_id in user_ids[:max_profiles_per_request]:
+        user = load_user(str(user_id))
+        if user:
+            found[user.id] = {'name': user.name, 'profile_img': user.avatar}
+    return {'profiles': found}
 
 @socketio.on('message')
 def handle_message(data):
@@ -515,6 +1284,7 @@ def handle_message(data):
         return {'error': 'User not authenticated'}
 
     try:
+        handle_start = time.perf_counter()
         room = data.get('room')
         message_text = data.get('message')
 
@@ -522,41 +1292,88 @@ def handle_message(data):
             return {'error': 'Message is required'}
 
         # For public chat, room will be None
-        room_id = None if room == 'null' or room is None else room
-
-        # Ensure profile picture is valid
-        profile_img = current_user.profile_img
-        if not profile_img or not isinstance(profile_img, str) or not profile_img.startswith(('http', '/')):
-            profile_img = url_for('static', filename='img/default-profile.png')
-
-        # Create new message
-        new_message = Message(
-            user_id=current_user.id,
-            room=room_id,
-            name=current_user.name,
-            message=message_text,
-            profile_img=profile_img,
-            created_at=datetime.now(timezone.utc)
-        )
+        room_id = None if room == 'null' or room is None else int(room)
 
-        # Save message to database
-        db.session.add(new_message)
-        db.session.flush()  # This ensures new_message.id is available
-        db.session.commit()
+        limited = throttled_socket_event('message', room=str(room_id) if room_id else 'public')
+        if limited:
+            return limited
+
+        # Checked before the message gets an id: a write-behind row for a missing
+        # room would only fail in the background, after it was broadcast
+        if not can_post(room_id, current_user.id):
+            return {'error': 'Access denied'}
+
+        # Profile picture with the default already filled in by user_profile()
+        profile_img = current_user.avatar
+
+        created_at = datetime.now(timezone.utc)
+        db_start = time.perf_counter()
+
+        if message_write_behind:
+            # Queue the row for the background writer and broadcast right away
+            message_id = message_writer.allocate_id()
+            message_writer.submit({
+                'id': message_id,
+                'user_id': current_user.id,
+                'room': room_id,
+                'message': message_text,
+                'created_at': created_at
+            })
+        else:
+            # Create new message
+            new_message = Message(
+                user_id=current_user.id,
+                room=room_id,
+                message=message_text,
+                created_at=created_at
+            )
+
+            # Save message to database, counting it for unread badges in the same transaction
+            db.session.add(new_message)
+            db.session.flush()  # This ensures new_message.id is available
+            unread_seqs = unread_counters.bump([{'room': room_id}])
+            db.session.commit()
+            message_id = new_message.id
+
+        message_db_seconds.observe(time.perf_counter() - db_start)
+
+        if recent_messages_enabled:
+            recent_messages.append(room_id, {
+                'id': message_id,
+                'user_id': current_user.id,
+                'message': message_text,
+                'room_id': room_id,
+                'created_at': created_at.isoformat()
+            })
 
         # Emit message to room or public chat
-        emit('message', {
-            'id': new_message.id,
+        emit_start = time.perf_counter()
+        payload = {
+            'id': message_id,
             'user_id': current_user.id,
             'name': current_user.name,
             'message': message_text,
             'profile_img': profile_img,
             'room': room_id,
-            'created_at': new_message.created_at.isoformat()
-        }, room=str(room_id) if room_id else 'public')
+            'created_at': created_at.isoformat()
+        }
+        if message_batch_window_ms > 0:
+            message_batcher.add(str(room_id) if room_id else 'public', payload)
+        else:
+            message_wire.send(str(room_id) if room_id else 'public', [payload])
+
+        if not message_write_behind:
+            unread_counters.publish(unread_seqs)
+
+        now = time.perf_counter()
+        message_emit_seconds.observe(now - emit_start)
+        message_handle_seconds.observe(now - handle_start)
+        messages_total.inc(room_type='room' if room_id else 'public')
 
         return {'success': True}
 
+    except WriterBusy:
+        return {'error': 'Server is busy, please try again'}
     except Exception as e:
         print(f"Error handling message: {str(e)}")
         db.session.rollback()
@@ -568,41 +1385,313 @@ def logout():
     logout_user()
     return redirect(url_for('home'))
 
+@app.route('/get_messages', defaults={'room_id': None})
 @app.route('/get_messages/<int:room_id>')
 @login_required
 def get_messages(room_id):
+    limited = throttled_request('get_messages')
+    if limited:
+        return limited
+
     try:
-        # Verify room exists and user has access
+        # Verify room exists and user has access (public chat has no room)
+        if room_id is not None:
+            room = Room.query.get(room_id)
+            if not room:
+                return jsonify({'error': 'Room not found'}), 404
+
+            # For private rooms, check membership
+            if room.is_private and not is_room_member(room.id, current_user.id):
+                return jsonify({'error': 'Access denied'}), 403
+
+        try:
+            before_id = parse_message_cursor('before_id')
+            after_id = parse_message_cursor('after_id')
+            limit = parse_message_cursor('limit')
+        except ValueError:
+            return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+        if before_id is not None and after_id is not None:
+            return jsonify({'error': 'Use either before_id or after_id, not both'}), 400
+
+        # Get one page of messages for the room, oldest first
+        message_list, has_more = fetch_message_page(room_id, before_id=before_id, after_id=after_id, limit=limit)
+
+        return jsonify({
+            'room_id': room_id,
+            'messages': message_list,
+            'users': message_authors(message_list),
+            'has_more': has_more
+        })
+
+    except Exception as e:
+        print(f"Error getting messages: {str(e)}")
+        return jsonify({'error': 'Failed to load messages'}), 500
+
+@app.route('/export_messages', defaults={'room_id': None})
+@app.route('/export_messages/<int:room_id>')
+@login_required
+def export_messages(room_id):
+    """Stream a room's history as NDJSON, optionally limited to ``since <= created_at < until``."""
+    limited = throttled_request('export')
+    if limited:
+        return limited
+
+    if room_id is not None:
         room = Room.query.get(room_id)
         if not room:
             return jsonify({'error': 'Room not found'}), 404
-
-        # For private rooms, check membership
-        if room.is_private and current_user not in room.members:
+        if room.is_private and not is_room_member(room.id, current_user.id):
             return jsonify({'error': 'Access denied'}), 403
 
-        # Get messages for the room, ordered by timestamp
-        messages = Message.query.filter_by(room=room_id)\
-            .order_by(Message.created_at.asc())\
-            .all()
-
-        # Format messages for JSON response
-        message_list = []
-        for message in messages:
-            message_list.append({
-                'id': message.id,
-                'name': message.name,
-                'message': message.message,
-                'profile_img': message.profile_img,
-                'room_id': room_id,
-                'created_at': message.created_at.isoformat() if message.created_at else None
-            })
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 dates'}), 400
+
+    if message_write_behind:
+        # Include messages that were broadcast but not flushed yet
+        message_writer.flush()
+
+    filename = f"messages-{room_id if room_id is not None else 'public'}.ndjson"
+    lines = export_lines(db, Message.__table__, User.__table__, room_id, since=since, until=until, chunk_size=export_chunk_size)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def accessible_messages(user_id):
+    # Public chat, public rooms and the private rooms the user is a member of
+    return db.or_(
+        Message.room.is_(None),
+        Message.room.in_(db.select(Room.id).where(Room.is_private.isnot(True))),
+        Message.room.in_(db.select(RoomMember.room_id).where(RoomMember.user_id == user_id))
+    )
+
+@app.route('/search')
+@login_required
+def search():
+    """Search messages in every room the user can read, or in ``room_id``, newest first."""
+    limited = throttled_request('search')
+    if limited:
+        return limited
+
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'Search text is required'}), 400
 
-        return jsonify(message_list)
+    try:
+        room_id = parse_message_cursor('room_id')
+        before_id = parse_message_cursor('before_id')
+        limit = min(max(parse_message_cursor('limit') or search_page_size, 1), max_search_page_size)
+    except ValueError:
+        return jsonify({'error': 'Invalid search parameters'}), 400
+
+    access = accessible_messages(current_user.id)
+    if room_id is not None:
+        room = Room.query.get(room_id)
+        if not room:
+            return jsonify({'error': 'Room not found'}), 404
+        if room.is_private and not is_room_member(room.id, current_user.id):
+            return jsonify({'error': 'Access denied'}), 403
+        access = Message.room == room_id
 
+    try:
+        rows, has_more = message_search.search(text, access, before_id=before_id, limit=limit)
     except Exception as e:
-        print(f"Error getting messages: {str(e)}")
-        return jsonify({'error': 'Failed to load messages'}), 500
+        print(f"Error searching messages: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': 'Search failed'}), 500
+
+    results = [{
+        'id': row.id,
+        'user_id': row.user_id,
+        'message': row.message,
+        'highlight': highlight_html(row.highlight),
+        'room_id': row.room,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    } for row in rows]
+
+    return jsonify({
+        'query': text,
+        'results': results,
+        'users': message_authors(results),
+        'has_more': has_more,
+        'next_before_id': results[-1]['id'] if has_more else None
+    })
+
+@app.cli.command('import-messages')
+@click.argument('path', type=click.File('r', encoding='utf-8'))
+@click.option('--room-id', type=int, default=None, help='Load every message into this room instead of the exported one')
+@click.option('--keep-ids', is_flag=True, help='Keep the exported message ids (target table must not have them yet)')
+@click.option('--batch-size', type=int, default=5000, show_default=True)
+def import_messages(path, room_id, keep_ids, batch_size):
+    """Load an NDJSON export from /export_messages into the messages table ("-" reads stdin)."""
+    if room_id is not None and not db.session.get(Room, room_id):
+        raise click.ClickException(f'Room {room_id} does not exist')
+
+    start = time.perf_counter()
+    importer = MessageImporter(db, Message.__table__, User.__table__, batch_size=batch_size, keep_ids=keep_ids)
+    try:
+        importer.run(read_lines(path, room_id=room_id, keep_ids=keep_ids))
+    except ValueError as e:
+        raise click.ClickException(f'{str(e)} ({importer.imported} messages imported before the error)')
+
+    # Cached newest pages do not know about the imported rows
+    recent_messages.clear()
+    click.echo(f'Imported {importer.imported} messages ({importer.created_users} placeholder users) '
+               f'in {time.perf_counter() - start:.1f}s')
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Only list the migrations that have not been applied')
+def migrate(status):
+    """Apply pending schema migrations."""
+    if status:
+        pending = schema_migrator.pending()
+        click.echo(f'Schema version {schema_migrator.current()}, {len(pending)} pending')
+        for migration in pending:
+            click.echo(f'  {migration.version}: {migration.description}')
+        return
+    applied = migrate_database()
+    click.echo(f'Applied {len(applied)} migrations, schema version {schema_migrator.current()}')
+
+@app.cli.command('backfill-message-authors')
+@click.option('--batch-size', type=int, default=author_backfill_batch_size, show_default=True)
+@click.option('--pause', type=float, default=0, show_default=True, help='Seconds to wait between batches')
+@click.option('--drop-columns', is_flag=True,
+              help='Then drop messages.name and messages.profile_img (only once no old worker is running)')
+def backfill_message_authors(batch_size, pause, drop_columns):
+    """Copy message sender names and pictures into users, one batch per transaction."""
+    with db.engine.connect() as connection:
+        if not has_author_columns(db, connection, Message.__tablename__):
+            click.echo('Nothing to do: messages no longer have name and profile_img')
+            return
+
+    start = time.perf_counter()
+    backfill = AuthorBackfill(db, User.__table__, Message.__tablename__, batch_size=batch_size, pause=pause)
+    backfill.run()
+    if drop_columns:
+        # Rows written since the last batch are copied in the same transaction as the drop
+        with db.engine.begin() as connection:
+            backfill.run(connection)
+            backfill.finish(connection)
+    click.echo(f'Read {backfill.scanned} messages, added {backfill.created_users} placeholder users, '
+               f'updated {backfill.updated_users} users in {time.perf_counter() - start:.1f}s'
+               + ('; dropped messages.name and messages.profile_img' if drop_columns else ''))
+
+@app.cli.command('expire-messages')
+def expire_messages():
+    """Run one round of message retention now instead of waiting for the background job."""
+    deleted = retention_job.run_once()
+    click.echo(f'Deleted {deleted} expired messages ({retention_job.archived} archived)')
+
+@app.cli.command('partition-messages')
+def partition_messages():
+    """Convert the messages table to monthly partitions (PostgreSQL, writers stopped)."""
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('Partitioning needs PostgreSQL')
+    moved = message_partitions.convert()
+    with db.engine.begin() as connection:
+        message_search.setup(connection)
+    click.echo(f'Moved {moved} messages into the partitioned table; '
+               f'drop {Message.__tablename__}_unpartitioned once checked')
+
+# Counters kept by the caches and broadcasters, read at scrape time
+metrics.counter('square_chat_recent_messages_hits_total', 'Recent-message buffer hits',
+                function=lambda: recent_messages.hits)
+metrics.counter('square_chat_recent_messages_misses_total', 'Recent-message buffer misses',
+                function=lambda: recent_messages.misses)
+metrics.counter('square_chat_recent_messages_evictions_total', 'Rooms evicted from the recent-message buffer',
+                function=lambda: recent_messages.evictions)
+metrics.gauge('square_chat_recent_messages_bytes', 'Estimated size of the recent-message buffer',
+              function=lambda: recent_messages.total_bytes)
+metrics.counter('square_chat_membership_cache_hits_total', 'Membership cache hits',
+                function=lambda: membership_cache.hits)
+metrics.counter('square_chat_membership_cache_misses_total', 'Membership cache misses',
+                function=lambda: membership_cache.misses)
+metrics.counter('square_chat_user_cache_hits_total', 'User profile cache hits (this worker)',
+                function=lambda: user_cache.local.hits)
+metrics.counter('square_chat_user_cache_misses_total', 'User profile cache misses (this worker)',
+                function=lambda: user_cache.local.misses)
+metrics.counter('square_chat_member_count_suppressed_total', 'member_count updates coalesced away',
+                function=lambda: member_count_broadcaster.suppressed)
+metrics.counter('square_chat_message_batches_total', 'messages_batch events sent',
+                function=lambda: message_batcher.batches)
+metrics.counter('square_chat_batched_messages_total', 'Chat messages sent inside messages_batch events',
+                function=lambda: message_batcher.messages)
+metrics.counter('square_chat_rate_limited_total', 'Requests and socket events rejected by rate limits',
+                function=lambda: sum(rate_limiter.throttled.values()))
+metrics.counter('square_chat_retention_deleted_total', 'Messages deleted by retention',
+                function=lambda: retention_job.deleted)
+metrics.counter('square_chat_retention_archived_total', 'Messages archived by retention',
+                function=lambda: retention_job.archived)
+metrics.gauge('square_chat_message_writer_pending', 'Messages waiting for the write-behind flush',
+              function=lambda: len(message_writer.pending))
+metrics.counter('square_chat_message_writer_dropped_total', 'Write-behind messages the database rejected',
+                function=lambda: message_writer.dropped)
+metrics.gauge('square_chat_db_pool_checked_out', 'Database connections currently checked out',
+              function=lambda: db.engine.pool.checkedout() if hasattr(db.engine.pool, 'checkedout') else 0)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Unauthenticated so a local Prometheus can scrape it; keep it off public proxies
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/healthz')
+def liveness():
+    # The process is up and serving requests
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readiness():
+    # Whether a load balancer should send new clients here
+    problems = []
+    if production_server.draining:
+        problems.append('draining')
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except Exception as e:
+        print(f"Error checking database: {str(e)}")
+        problems.append('database unavailable')
+    if message_write_behind and len(message_writer.pending) >= message_max_pending:
+        problems.append('message queue full')
+
+    if problems:
+        return jsonify({'status': 'unavailable', 'problems': problems}), 503
+    return jsonify({'status': 'ok'})
+
+@app.route('/stats')
+@login_required
+def stats():
+    # Counters for sizing the in-process caches and broadcast coalescing
+    return jsonify({
+        'recent_messages_enabled': recent_messages_enabled,
+        'recent_messages': recent_messages.stats(),
+        'membership': membership_cache.stats(),
+        'users': user_cache.stats(),
+        'member_count': member_count_broadcaster.stats(),
+        'message_batches': message_batcher.stats(),
+        'wire': message_wire.stats(),
+        'rate_limited': rate_limiter.throttled,
+        'retention': retention_job.stats()
+    })
+
+@app.route('/room_retention/<int:room_id>', methods=['POST'])
+@login_required
+def set_room_retention(room_id):
+    room = Room.query.get(room_id)
+    if not room:
+        return jsonify({'error': 'Room not found'}), 404
+
+    if room.created_by != current_user.id:
+        return jsonify({'error': 'Only room creator can change retention'}), 403
+
+    try:
+        room.retention_days = parse_retention_days((request.get_json() or {}).get('retention_days'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'retention_days must be a whole number of days'}), 400
+
+    db.session.commit()
+    return jsonify({'success': True, 'retention_days': room.retention_days})
 
 @app.route('/remove_member/<int:room_id>/<string:user_id>', methods=['POST'])
 @login_required
@@ -622,22 +1711,14 @@ def remove_member(room_id, user_id):
             return jsonify({'error': 'User not found'}), 404
 
         # Remove user from room members
-        if user_to_remove in room.members:
-            room.members.remove(user_to_remove)
+        removed = RoomMember.query.filter_by(room_id=room_id, user_id=user_id).delete()
+        if removed:
+            ReadMarker.query.filter_by(room_id=room_id, user_id=user_id).delete()
             db.session.commit()
+            invalidate_membership(room_id, user_id)
 
-            # Get updated member list
-            member_list = [{
-                'id': member.id,
-                'name': member.name,
-                'profile_img': member.profile_img
-            } for member in room.members]
-
-            # Emit updated member list to all room members
-            socketio.emit('member_list_update', {
-                'room_id': room_id,
-                'members': member_list
-            }, room=str(room_id))
+            # Tell the room (including the removed user) who left the member list
+            emit_member_delta('member_removed', room_id, {'user_id': user_id})
 
             # Emit kick event to the removed user
             socketio.emit('kicked_from_room', {
@@ -646,12 +1727,8 @@ def remove_member(room_id, user_id):
             }, room=str(user_id))
 
             # Update member count
-            if room_id in connected_users:
-                connected_users[room_id].discard(user_id)
-                socketio.emit('member_count', {
-                    'room_id': room_id,
-                    'count': len(connected_users[room_id])
-                }, room=str(room_id))
+            presence.remove_user(str(room_id), user_id)
+            member_count_broadcaster.schedule(str(room_id))
 
             return jsonify({'success': True})
         else:
@@ -664,4 +1741,17 @@ def remove_member(room_id, user_id):
 
 # Run the app with SocketIO
 if __name__ == '__main__':
-    socketio.run(app, host="0.0.0.0", port="5000", debug=True)
\ No newline at end of file
+    create_app()
+    if server_mode == 'production':
+        if server_workers > 1 and not message_queue_url:
+            raise SystemExit("server_workers > 1 needs message_queue_url so rooms are shared between workers")
+        production_server.run()
+    else:
+        # atexit hooks do not run on SIGTERM, and the reloader's parent process kills
+        # the serving child outright, so queued write-behind messages need both handled
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            socketio.run(app, host=server_host, port=server_port, debug=True,
+                         use_reloader=not message_write_behind)
+        finally:
+            flush_pending_messages()
\ No newline at end of file
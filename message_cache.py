@@ -0,0 +1,140 @@
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+# Rough per-message overhead of the dict, its keys and the deque slot
+MESSAGE_OVERHEAD_BYTES = 400
+
+
+def message_size(message):
+    return MESSAGE_OVERHEAD_BYTES + sum(len(value) for value in message.values() if isinstance(value, str))
+
+
+class RoomBuffer:
+    def __init__(self, size):
+        self.messages = deque(maxlen=size)
+        self.bytes = 0
+        self.has_older = False
+
+
+class RecentMessages:
+    """Newest messages of recently used rooms, already serialized with to_dict().
+
+    A room is cached once its newest page has been loaded from the database and
+    then kept current by append(). Rooms are evicted least recently used first
+    once the estimated size of all buffers goes over ``max_bytes``.
+
+    A page read from the database can miss messages committed while it was
+    being read, so the read runs inside recording(): messages appended to
+    the room meanwhile are kept and merged into the page by seed().
+    """
+
+    def __init__(self, size=100, max_bytes=64 * 1024 * 1024):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.rooms = OrderedDict()
+        self.recorders = defaultdict(list)  # room -> lists collecting appends during a read
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, room_id, limit):
+        # Returns (messages, has_more) for the newest page, or None on a miss
+        buffer = self.rooms.get(room_id)
+        if buffer is None or limit > self.size or (len(buffer.messages) < limit and buffer.has_older):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.rooms.move_to_end(room_id)
+        messages = list(buffer.messages)[-limit:]
+        return messages, len(buffer.messages) > limit or buffer.has_older
+
+    def since(self, room_id, since_id):
+        # Messages newer than since_id, or None when the buffer does not reach back to it
+        buffer = self.rooms.get(room_id)
+        if buffer is not None:
+            messages = list(buffer.messages)
+            for index in range(len(messages) - 1, -1, -1):
+                if messages[index]['id'] == since_id:
+                    self.hits += 1
+                    self.rooms.move_to_end(room_id)
+                    return messages[index + 1:]
+        self.misses += 1
+        return None
+
+    @contextmanager
+    def recording(self, room_id):
+        # Yields a list that collects the messages appended to the room until the block ends
+        appended = []
+        self.recorders[room_id].append(appended)
+        try:
+            yield appended
+        finally:
+            recorders = [recorder for recorder in self.recorders[room_id] if recorder is not appended]
+            if recorders:
+                self.recorders[room_id] = recorders
+            else:
+                del self.recorders[room_id]
+
+    def seed(self, room_id, messages, has_more, appended=()):
+        # Cache the newest page just read from the database, plus what was appended during the read
+        page_ids = {message['id'] for message in messages}
+        messages = messages + [message for message in appended if message['id'] not in page_ids]
+        self.discard(room_id)
+        buffer = RoomBuffer(self.size)
+        buffer.has_older = has_more or len(messages) > self.size
+        for message in messages[-self.size:]:
+            buffer.messages.append(message)
+            buffer.bytes += message_size(message)
+        self.rooms[room_id] = buffer
+        self.total_bytes += buffer.bytes
+        self._evict()
+
+    def append(self, room_id, message):
+        for recorder in self.recorders.get(room_id, ()):
+            recorder.append(message)
+
+        # Cold rooms are left alone; they are seeded on their next page load
+        buffer = self.rooms.get(room_id)
+        if buffer is None:
+            return
+
+        if len(buffer.messages) == buffer.messages.maxlen:
+            dropped = message_size(buffer.messages[0])
+            buffer.bytes -= dropped
+            self.total_bytes -= dropped
+            buffer.has_older = True
+
+        size = message_size(message)
+        buffer.messages.append(message)
+        buffer.bytes += size
+        self.total_bytes += size
+        self.rooms.move_to_end(room_id)
+        self._evict()
+
+    def discard(self, room_id):
+        buffer = self.rooms.pop(room_id, None)
+        if buffer is not None:
+            self.total_bytes -= buffer.bytes
+
+    def clear(self):
+        self.rooms.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            'rooms': len(self.rooms),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.rooms:
+            _, buffer = self.rooms.popitem(last=False)
+            self.total_bytes -= buffer.bytes
+            self.evictions += 1
@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+EXPORT_COLUMNS = ('id', 'user_id', 'room', 'message', 'created_at')
+
+# Sender fields of an export line, which come from users rather than messages
+AUTHOR_FIELDS = ('name', 'profile_img')
+
+
+def to_utc_naive(value):
+    # created_at is stored as naive UTC, so compare against naive UTC values
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def message_line(row):
+    # One NDJSON line per message, shared by exports and retention archives
+    return json.dumps({
+        'id': row.id,
+        'user_id': row.user_id,
+        'room_id': row.room,
+        'name': row.name,
+        'message': row.message,
+        'profile_img': row.profile_img,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }) + '\n'
+
+
+def export_query(db, messages, users):
+    # Messages with their sender's current name and picture, as message_line() reads them
+    return db.select(*(messages.c[name] for name in EXPORT_COLUMNS), *(users.c[name] for name in AUTHOR_FIELDS))\
+        .select_from(messages.outerjoin(users, users.c.id == messages.c.user_id))
+
+
+def export_lines(db, table, users_table, room_id=None, since=None, until=None, chunk_size=1000):
+    """Yield a room's messages as NDJSON lines, oldest first.
+
+    Rows are read with ``yield_per`` so only ``chunk_size`` of them are held at
+    a time (a server-side cursor on PostgreSQL), whatever the room's size.
+    """
+    query = export_query(db, table, users_table).where(
+        table.c.room.is_(None) if room_id is None else table.c.room == room_id)
+    if since is not None:
+        query = query.where(table.c.created_at >= to_utc_naive(since))
+    if until is not None:
+        query = query.where(table.c.created_at < to_utc_naive(until))
+    query = query.order_by(table.c.created_at, table.c.id).execution_options(yield_per=chunk_size)
+
+    with db.engine.connect() as connection:
+        for row in connection.execute(query):
+            yield message_line(row)
+
+
+def read_lines(lines, room_id=None, keep_ids=False):
+    # Parse NDJSON export lines into messages rows, skipping blank lines
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            row = {
+                'user_id': record['user_id'],
+                'room': record.get('room_id') if room_id is None else room_id,
+                'name': record['name'],
+                'message': record['message'],
+                'profile_img': record.get('profile_img'),
+                'created_at': to_utc_naive(datetime.fromisoformat(record['created_at']))
+                              if record.get('created_at') else datetime.now(timezone.utc).replace(tzinfo=None)
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'Line {number}: {str(e)}')
+        if keep_ids:
+            row['id'] = record['id']
+        yield row
+
+
+class MessageImporter:
+    """Loads exported messages into the messages table in fixed-size batches.
+
+    Each batch is one COPY on PostgreSQL (psycopg2) and one executemany insert
+    elsewhere, committed on its own, so memory stays bounded by ``batch_size``.
+    Sender names and pictures in the lines are not stored with the messages:
+    authors missing from the users table are added as placeholders with them,
+    and their real profile replaces it on first login.
+    """
+
+    def __init__(self, db, messages_table, users_table, batch_size=5000, keep_ids=False):
+        self.db = db
+        self.messages = messages_table
+        self.users = users_table
+        self.batch_size = batch_size
+        self.keep_ids = keep_ids
+        self.imported = 0
+        self.created_users = 0
+
+    def run(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        if self.keep_ids:
+            self._sync_sequence()
+        return self.imported
+
+    def _write(self, batch):
+        authors = {row['user_id']: row for row in batch}
+        batch = [{name: value for name, value in row.items() if name not in AUTHOR_FIELDS} for row in batch]
+        columns = list(batch[0])
+        with self.db.engine.begin() as connection:
+            self._add_missing_users(connection, authors)
+            if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in batch:
+                    # COPY's CSV format reads unquoted empty fields as NULL
+                    writer.writerow(['' if row[c] is None else row[c] for c in columns])
+                buffer.seek(0)
+                cursor = connection.connection.cursor()
+                cursor.copy_expert(
+                    f"COPY {self.messages.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                connection.execute(self.messages.insert(), batch)
+        self.imported += len(batch)
+
+    def _add_missing_users(self, connection, authors):
+        # authors maps each user id to the newest line that names them
+        existing = set(connection.execute(
+            self.db.select(self.users.c.id).where(self.users.c.id.in_(list(authors)))
+        ).scalars())
+        missing = [{'id': user_id, 'name': row['name'], 'email': f'{user_id}@imported.invalid',
+                    'profile_img': row.get('profile_img')}
+                   for user_id, row in authors.items() if user_id not in existing]
+        if missing:
+            connection.execute(self.users.insert(), missing)
+            self.created_users += len(missing)
+
+    def _sync_sequence(self):
+        # Explicit ids bypass the sequence, so move it past the imported rows
+        with self.db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(self.db.text(
+                    "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                    "(SELECT COALESCE(MAX(id), 1) FROM " + self.messages.name + "))"
+                ), {'table': self.messages.name})
@@ -0,0 +1,175 @@
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up, or is read from ``function`` at scrape time."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            return [f'{self.name} {self.function()}']
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}' for key, value in items]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from ``function`` at scrape time."""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is not None:
+            return [f'{self.name} {self.function()}']
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}' for key, value in items]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.values.items()]
+        lines = []
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.label_names, key, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.label_names, key, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """Holds the process's metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        return self._register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self._register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self._register(Histogram(*args, **kwargs))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+def instrument_pool(engine, histogram):
+    """Time how long callers wait to check a connection out of ``engine``'s pool.
+
+    SQLAlchemy has no event that fires before a checkout starts waiting, so the
+    pool's internal ``_do_get`` is wrapped. Pools created later by dispose()
+    are wrapped again through the engine's ``engine_disposed`` hook.
+    """
+    from sqlalchemy import event
+
+    def wrap(pool):
+        original = pool._do_get
+
+        def timed_do_get():
+            start = time.perf_counter()
+            try:
+                return original()
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        pool._do_get = timed_do_get
+
+    wrap(engine.pool)
+    event.listen(engine, 'engine_disposed', lambda eng: wrap(eng.pool))
@@ -0,0 +1,84 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy.schema import CreateColumn
+
+Migration = namedtuple('Migration', 'version description apply')
+
+
+class SchemaMigrator:
+    """Versioned schema changes, applied by ``flask migrate`` instead of at import.
+
+    ``migrations`` is a list of Migration(version, description, apply) where
+    ``apply(connection)`` makes the change. Each one runs in its own
+    transaction together with its row in ``schema_migrations``, so a failed
+    migration leaves nothing half applied and is retried next time. Steps
+    check what exists before changing it, because databases created before
+    versioning already have some of them. On PostgreSQL an advisory lock keeps
+    two deploys from migrating at once.
+    """
+
+    LOCK_KEY = 5517001  # pg_advisory_lock key, any constant unique to this app
+
+    def __init__(self, db, migrations, table='schema_migrations'):
+        self.db = db
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.table = table
+
+    def _ensure_table(self, connection):
+        connection.execute(self.db.text(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            f'version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)'))
+
+    def current(self):
+        # Highest applied version, 0 for a database that was never migrated
+        engine = self.db.engine
+        if not self.db.inspect(engine).has_table(self.table):
+            return 0
+        with engine.connect() as connection:
+            return connection.execute(self.db.text(f'SELECT MAX(version) FROM {self.table}')).scalar() or 0
+
+    def pending(self):
+        current = self.current()
+        return [migration for migration in self.migrations if migration.version > current]
+
+    def migrate(self):
+        """Apply every pending migration in order; returns the ones applied."""
+        engine = self.db.engine
+        with engine.connect() as lock:
+            if engine.dialect.name == 'postgresql':
+                lock.execute(self.db.text('SELECT pg_advisory_lock(:key)'), {'key': self.LOCK_KEY})
+                lock.commit()
+            try:
+                with engine.begin() as connection:
+                    self._ensure_table(connection)
+                applied = []
+                for migration in self.pending():
+                    with engine.begin() as connection:
+                        migration.apply(connection)
+                        connection.execute(self.db.text(
+                            f'INSERT INTO {self.table} (version, description, applied_at) '
+                            f'VALUES (:version, :description, :applied_at)'
+                        ), {'version': migration.version, 'description': migration.description,
+                            'applied_at': datetime.now(timezone.utc).replace(tzinfo=None)})
+                    print(f"Applied migration {migration.version}: {migration.description}")
+                    applied.append(migration)
+                return applied
+            finally:
+                if engine.dialect.name == 'postgresql':
+                    lock.execute(self.db.text('SELECT pg_advisory_unlock(:key)'), {'key': self.LOCK_KEY})
+                    lock.commit()
+
+
+def add_missing_columns(db, connection, table, names):
+    # ALTER TABLE ... ADD COLUMN for the model columns a table created earlier lacks
+    existing = {column['name'] for column in db.inspect(connection).get_columns(table.name)}
+    for name in names:
+        if name not in existing:
+            column_ddl = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+            connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}'))
+
+
+def create_indexes(connection, table):
+    for index in table.indexes:
+        index.create(bind=connection, checkfirst=True)
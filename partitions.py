@@ -0,0 +1,118 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy.schema import CreateTable
+
+
+def month_start(day, offset=0):
+    # First day of the month ``offset`` months after ``day``'s month
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class MessagePartitions:
+    """PostgreSQL range partitioning of the messages table by created_at month.
+
+    The parent table is created from the Message model with (id, created_at) as
+    primary key, since a partitioned table's key must include the partition
+    column. maintain() keeps partitions for the previous month through
+    ``months_ahead`` future months and drops old partitions once retention has
+    emptied them. A default partition catches rows outside every range, e.g.
+    old messages loaded by import-messages.
+    """
+
+    def __init__(self, db, table, months_ahead=2):
+        self.db = db
+        self.table = table
+        self.months_ahead = months_ahead
+
+    def partition_name(self, month):
+        return f'{self.table.name}_p{month.year}_{month.month:02d}'
+
+    def is_partitioned(self, connection):
+        return bool(connection.execute(self.db.text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+        ), {'name': self.table.name}).scalar())
+
+    def create_table(self, connection):
+        ddl = str(CreateTable(self.table).compile(dialect=connection.dialect)).rstrip()
+        ddl = ddl.replace('PRIMARY KEY (id)', 'PRIMARY KEY (id, created_at)')
+        connection.execute(self.db.text(ddl + ' PARTITION BY RANGE (created_at)'))
+        connection.execute(self.db.text(
+            f'CREATE TABLE {self.table.name}_default PARTITION OF {self.table.name} DEFAULT'))
+
+    def ensure(self, connection, first_month, last_month):
+        month = first_month
+        while month <= last_month:
+            connection.execute(self.db.text(
+                f"CREATE TABLE IF NOT EXISTS {self.partition_name(month)} PARTITION OF {self.table.name} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+            ))
+            month = month_start(month, 1)
+
+    def partitions(self, connection):
+        # Monthly partitions (not the default one) as {month: table name}
+        names = connection.execute(self.db.text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :name AND pg_table_is_visible(p.oid)"
+        ), {'name': self.table.name}).scalars().all()
+        prefix = f'{self.table.name}_p'
+        found = {}
+        for name in names:
+            if name.startswith(prefix):
+                year, month = name[len(prefix):].split('_')
+                found[date(int(year), int(month), 1)] = name
+        return found
+
+    def maintain(self):
+        """Create upcoming partitions and drop empty ones older than last month."""
+        current = month_start(datetime.now(timezone.utc).date())
+        with self.db.engine.begin() as connection:
+            if not self.is_partitioned(connection):
+                return
+            self.ensure(connection, month_start(current, -1), month_start(current, self.months_ahead))
+            for month, name in self.partitions(connection).items():
+                if month < month_start(current, -1) and not connection.execute(
+                        self.db.text(f'SELECT EXISTS (SELECT 1 FROM {name})')).scalar():
+                    connection.execute(self.db.text(f'DROP TABLE {name}'))
+
+    def convert(self):
+        """Move an existing plain messages table into a new partitioned one.
+
+        The old table is renamed to <name>_unpartitioned and left in place for
+        the operator to drop once the copy has been checked. Writes must be
+        stopped while this runs.
+        """
+        name = self.table.name
+        old = f'{name}_unpartitioned'
+        with self.db.engine.begin() as connection:
+            if self.is_partitioned(connection):
+                return 0
+
+            connection.execute(self.db.text(f'ALTER TABLE {name} RENAME TO {old}'))
+            connection.execute(self.db.text(f'ALTER INDEX IF EXISTS {name}_pkey RENAME TO {old}_pkey'))
+            for index in self.table.indexes:
+                connection.execute(self.db.text(
+                    f'ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_unpartitioned'))
+            # Indexes created outside the model, e.g. the full-text index
+            connection.execute(self.db.text(
+                f'ALTER INDEX IF EXISTS ix_{name}_message_fts RENAME TO ix_{name}_unpartitioned_message_fts'))
+
+            self.create_table(connection)
+            for index in self.table.indexes:
+                index.create(bind=connection)
+
+            first = connection.execute(self.db.text(f'SELECT MIN(created_at) FROM {old}')).scalar()
+            current = month_start(datetime.now(timezone.utc).date())
+            self.ensure(connection, month_start(first or current), month_start(current, self.months_ahead))
+
+            columns = ', '.join(column.name for column in self.table.columns)
+            values = ', '.join('COALESCE(created_at, now())' if column.name == 'created_at' else column.name
+                               for column in self.table.columns)
+            moved = connection.execute(self.db.text(
+                f'INSERT INTO {name} ({columns}) SELECT {values} FROM {old}')).rowcount
+            connection.execute(self.db.text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {name}))"))
+        return moved
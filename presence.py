@@ -0,0 +1,280 @@
+import time
+
+
+class MemoryPresence:
+    """Tracks which users are connected to which rooms inside this process.
+
+    Each user is counted once per room however many tabs (sids) they have open,
+    and every sid keeps a reverse index of its rooms so disconnects only touch
+    the rooms that sid actually joined.
+    """
+
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self.rooms = {}        # room -> {user_id: set of sids}
+        self.sid_rooms = {}    # sid -> set of rooms
+        self.sid_user = {}     # sid -> user_id
+        self.last_seen = {}    # sid -> last heartbeat timestamp
+        self.versions = {}     # room -> member list version
+
+    def join(self, room, user_id, sid):
+        self.sid_user[sid] = user_id
+        self.sid_rooms.setdefault(sid, set()).add(room)
+        self.rooms.setdefault(room, {}).setdefault(user_id, set()).add(sid)
+        self.last_seen[sid] = time.time()
+        return len(self.rooms[room])
+
+    def leave(self, room, user_id, sid):
+        rooms = self.sid_rooms.get(sid)
+        if rooms:
+            rooms.discard(room)
+        self._drop(room, user_id, sid)
+        return self.count(room)
+
+    def disconnect(self, sid):
+        # Returns (room, count) for every room the sid was in
+        user_id = self.sid_user.pop(sid, None)
+        rooms = self.sid_rooms.pop(sid, set())
+        self.last_seen.pop(sid, None)
+
+        changed = []
+        for room in rooms:
+            self._drop(room, user_id, sid)
+            changed.append((room, self.count(room)))
+        return changed
+
+    def remove_user(self, room, user_id):
+        # Drop every sid of a user from one room, e.g. when they are kicked
+        for sid in self.rooms.get(room, {}).pop(user_id, set()):
+            rooms = self.sid_rooms.get(sid)
+            if rooms:
+                rooms.discard(room)
+        if room in self.rooms and not self.rooms[room]:
+            del self.rooms[room]
+        return self.count(room)
+
+    def count(self, room):
+        return len(self.rooms.get(room, ()))
+
+    def user_in_room(self, room, user_id):
+        return user_id in self.rooms.get(room, ())
+
+    def online_users(self, room):
+        return list(self.rooms.get(room, ()))
+
+    def bump_version(self, room):
+        # Member list deltas carry this so clients can spot a missed update
+        self.versions[room] = self.versions.get(room, 0) + 1
+        return self.versions[room]
+
+    def version(self, room):
+        return self.versions.get(room, 0)
+
+    def refresh(self, is_connected=None):
+        # Heartbeat the sids still connected; ones whose disconnect was missed age out in expire()
+        now = time.time()
+        for sid in self.last_seen:
+            if is_connected is None or is_connected(sid):
+                self.last_seen[sid] = now
+
+    def expire(self):
+        # Returns (room, count) for rooms that lost members to stale sids
+        cutoff = time.time() - self.ttl
+        changed = []
+        for sid in [sid for sid, seen in self.last_seen.items() if seen < cutoff]:
+            changed.extend(self.disconnect(sid))
+        return changed
+
+    def _drop(self, room, user_id, sid):
+        members = self.rooms.get(room)
+        if not members:
+            return
+        sids = members.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del members[user_id]
+        if not members:
+            del self.rooms[room]
+
+
+# KEYS: room hash, sid rooms set. ARGV: room, user_id
+_JOIN_SCRIPT = """
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+end
+return redis.call('HLEN', KEYS[1])
+"""
+
+# KEYS: room hash, sid rooms set. ARGV: room, user_id
+_LEAVE_SCRIPT = """
+if redis.call('SREM', KEYS[2], ARGV[1]) == 1 then
+    if redis.call('HINCRBY', KEYS[1], ARGV[2], -1) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[2])
+    end
+end
+return redis.call('HLEN', KEYS[1])
+"""
+
+
+class RedisPresence:
+    """Cluster-wide presence shared by every worker through Redis.
+
+    Layout (all keys under ``prefix``):
+      room:<room>   hash  user_id -> number of that user's sids in the room
+      sid:<sid>     set   rooms the sid has joined
+      sid_user      hash  sid -> user_id
+      user:<user>   set   sids of the user
+      seen          zset  sid -> last heartbeat, used to expire sids of dead workers
+      version:<room> int  member list version
+    """
+
+    def __init__(self, url, ttl=120, prefix='square-chat:presence:'):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.local_sids = set()
+        self._join = self.redis.register_script(_JOIN_SCRIPT)
+        self._leave = self.redis.register_script(_LEAVE_SCRIPT)
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def join(self, room, user_id, sid):
+        self.local_sids.add(sid)
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key('sid_user'), sid, user_id)
+        pipe.sadd(self._key('user', user_id), sid)
+        pipe.zadd(self._key('seen'), {sid: time.time()})
+        pipe.execute()
+        return self._join(keys=[self._key('room', room), self._key('sid', sid)], args=[room, user_id])
+
+    def leave(self, room, user_id, sid):
+        return self._leave(keys=[self._key('room', room), self._key('sid', sid)], args=[room, user_id])
+
+    def disconnect(self, sid):
+        self.local_sids.discard(sid)
+        user_id = self.redis.hget(self._key('sid_user'), sid)
+        changed = []
+        if user_id is not None:
+            for room in self.redis.smembers(self._key('sid', sid)):
+                changed.append((room, self.leave(room, user_id, sid)))
+
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key('sid', sid))
+        pipe.hdel(self._key('sid_user'), sid)
+        pipe.zrem(self._key('seen'), sid)
+        if user_id is not None:
+            pipe.srem(self._key('user', user_id), sid)
+        pipe.execute()
+        return changed
+
+    def remove_user(self, room, user_id):
+        for sid in self.redis.smembers(self._key('user', user_id)):
+            self.leave(room, user_id, sid)
+        return self.count(room)
+
+    def count(self, room):
+        return self.redis.hlen(self._key('room', room))
+
+    def user_in_room(self, room, user_id):
+        return bool(self.redis.hexists(self._key('room', room), user_id))
+
+    def online_users(self, room):
+        return self.redis.hkeys(self._key('room', room))
+
+    def bump_version(self, room):
+        return self.redis.incr(self._key('version', room))
+
+    def version(self, room):
+        return int(self.redis.get(self._key('version', room)) or 0)
+
+    def refresh(self, is_connected=None):
+        # Heartbeat for the sids connected to this worker
+        sids = [sid for sid in self.local_sids if is_connected is None or is_connected(sid)]
+        if sids:
+            now = time.time()
+            self.redis.zadd(self._key('seen'), {sid: now for sid in sids})
+
+    def expire(self):
+        # Reclaim sids whose worker stopped sending heartbeats
+        cutoff = time.time() - self.ttl
+        changed = []
+        for sid in self.redis.zrangebyscore(self._key('seen'), '-inf', cutoff):
+            changed.extend(self.disconnect(sid))
+        return changed
+
+
+def create_presence_store(url=None, ttl=120):
+    # redis:// URLs share presence across workers, anything else stays in-process
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisPresence(url, ttl=ttl)
+    return MemoryPresence(ttl=ttl)
+
+
+class CountBroadcaster:
+    """Coalesces member_count broadcasts so each room gets at most one per window.
+
+    Changes are collected in a set of dirty rooms and a single background loop
+    emits the current count of each once per ``window`` seconds while there are
+    any, so a burst of joins after a deploy costs one broadcast per room instead
+    of one per join.
+    """
+
+    def __init__(self, socketio, presence, window=0.25):
+        self.socketio = socketio
+        self.presence = presence
+        self.window = window
+        self.pending = set()
+        self.running = False
+        self.scheduled = 0
+        self.emitted = 0
+        self.suppressed = 0
+
+    def schedule(self, room):
+        self.scheduled += 1
+        if self.window <= 0:
+            self.emit(room)
+            return
+        if room in self.pending:
+            self.suppressed += 1
+            return
+        self.pending.add(room)
+        if not self.running:
+            self.running = True
+            self.socketio.start_background_task(self._run)
+
+    def emit(self, room):
+        self.emitted += 1
+        self.socketio.emit('member_count', {
+            'room_id': room if room == 'public' else int(room),
+            'count': self.presence.count(room)
+        }, room=room)
+
+    def flush(self):
+        rooms, self.pending = self.pending, set()
+        for room in rooms:
+            try:
+                self.emit(room)
+            except Exception as e:
+                print(f"Error emitting member count: {str(e)}")
+
+    def stats(self):
+        return {
+            'window': self.window,
+            'pending': len(self.pending),
+            'scheduled': self.scheduled,
+            'emitted': self.emitted,
+            'suppressed': self.suppressed,
+        }
+
+    def _run(self):
+        # Stops after a window with no changes; the next schedule() starts it again
+        while True:
+            self.socketio.sleep(self.window)
+            if not self.pending:
+                self.running = False
+                return
+            self.flush()
@@ -0,0 +1,110 @@
+import math
+import time
+
+
+def parse_limit(value):
+    """Parse "<count>/<seconds>" into (tokens per second, burst); "0" or "" disables."""
+    if not value or value == '0':
+        return None
+    count, _, seconds = value.partition('/')
+    count, seconds = float(count), float(seconds or 1)
+    return count / seconds, count
+
+
+class MemoryTokenBuckets:
+    """Token buckets kept in this process."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}  # key -> (tokens, last refill time, seconds until full)
+
+    def consume(self, key, rate, burst, cost=1):
+        # Returns 0 when allowed, otherwise seconds until enough tokens refill
+        now = time.monotonic()
+        tokens, last, _ = self.buckets.get(key, (burst, now, 0))
+        tokens = min(burst, tokens + (now - last) * rate)
+
+        if tokens < cost:
+            self.buckets[key] = (tokens, now, (burst - tokens) / rate)
+            return (cost - tokens) / rate
+
+        tokens -= cost
+        self.buckets[key] = (tokens, now, (burst - tokens) / rate)
+        if len(self.buckets) > self.max_keys:
+            self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # Buckets that have refilled completely behave like missing ones
+        for key in [key for key, (_, last, refill) in self.buckets.items() if now - last >= refill]:
+            del self.buckets[key]
+
+
+# KEYS: bucket hash. ARGV: rate, burst, cost, now, ttl ms
+_CONSUME_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens < cost then
+    wait = (cost - tokens) / rate
+else
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+return tostring(wait)
+"""
+
+
+class RedisTokenBuckets:
+    """Token buckets shared by every worker; each bucket expires once it would be full."""
+
+    def __init__(self, url, prefix='square-chat:ratelimit:'):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._consume = self.redis.register_script(_CONSUME_SCRIPT)
+
+    def consume(self, key, rate, burst, cost=1):
+        ttl_ms = math.ceil(burst / rate * 1000)
+        wait = self._consume(keys=[self.prefix + key], args=[rate, burst, cost, time.time(), ttl_ms])
+        return float(wait)
+
+
+class RateLimiter:
+    """Applies per-user and per-room limits for named actions.
+
+    ``limits`` maps (action, 'user' | 'room') to a (rate, burst) pair as
+    returned by parse_limit(); missing or None entries are not limited.
+    """
+
+    def __init__(self, buckets, limits):
+        self.buckets = buckets
+        self.limits = limits
+        self.throttled = {}
+
+    def check(self, action, user_id=None, room=None):
+        # Returns 0 when the action may proceed, else seconds to wait
+        for scope, key in (('user', user_id), ('room', room)):
+            limit = self.limits.get((action, scope))
+            if limit is None or key is None:
+                continue
+            wait = self.buckets.consume(f'{action}:{scope}:{key}', *limit)
+            if wait > 0:
+                self.throttled[action] = self.throttled.get(action, 0) + 1
+                return wait
+        return 0
+
+
+def create_rate_limiter(url, limits):
+    # redis:// URLs share buckets across workers, anything else stays in-process
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RateLimiter(RedisTokenBuckets(url), limits)
+    return RateLimiter(MemoryTokenBuckets(), limits)
@@ -0,0 +1,148 @@
+import gzip
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from message_io import export_query, message_line
+
+
+class RetentionJob:
+    """Archives and deletes messages older than their room's retention period.
+
+    Rooms use their own ``retention_days`` when it is set and ``default_days``
+    otherwise (public chat always uses the default); 0 keeps messages forever.
+    Expired rows are appended to gzipped NDJSON files under ``archive_dir``
+    (one per room and month, readable by the import-messages command) and then
+    deleted, ``batch_size`` rows per transaction with a pause in between so the
+    job never holds long locks. Without ``archive_dir`` rows are only deleted.
+    """
+
+    def __init__(self, app, db, messages_table, rooms_table, users_table, socketio, default_days=0,
+                 archive_dir=None, batch_size=1000, max_batches=100, pause=0.1,
+                 interval=3600, on_deleted=None, partitions=None):
+        self.app = app
+        self.db = db
+        self.messages = messages_table
+        self.rooms = rooms_table
+        self.users = users_table
+        self.socketio = socketio
+        self.default_days = default_days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause
+        self.interval = interval
+        self.on_deleted = on_deleted
+        self.partitions = partitions
+        self.running = False
+        self.archived = 0
+        self.deleted = 0
+        self.last_run = None
+
+    def start(self):
+        if not self.running and self.interval > 0:
+            self.running = True
+            self.socketio.start_background_task(self._run)
+
+    def policies(self, connection):
+        # (retention days, condition) pairs; rooms without their own setting use the default
+        rooms, messages = self.rooms.c, self.messages.c
+        policies = []
+        if self.default_days > 0:
+            policies.append((self.default_days, self.db.or_(
+                messages.room.is_(None),
+                messages.room.in_(self.db.select(rooms.id).where(rooms.retention_days.is_(None)))
+            )))
+        custom = connection.execute(
+            self.db.select(rooms.retention_days).where(rooms.retention_days > 0).distinct()
+        ).scalars().all()
+        for days in custom:
+            policies.append((days, messages.room.in_(
+                self.db.select(rooms.id).where(rooms.retention_days == days))))
+        return policies
+
+    def run_once(self):
+        """Expire one round of messages; returns the number of rows deleted."""
+        deleted = 0
+        batches = 0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self.app.app_context():
+            with self.db.engine.connect() as connection:
+                policies = self.policies(connection)
+
+            for days, condition in policies:
+                cutoff = now - timedelta(days=days)
+                while batches < self.max_batches:
+                    count = self._expire_batch(condition, cutoff)
+                    deleted += count
+                    batches += 1
+                    if count < self.batch_size:
+                        break
+                    self.socketio.sleep(self.pause)
+
+            if self.partitions is not None:
+                self.partitions.maintain()
+
+        self.last_run = time.time()
+        return deleted
+
+    def _expire_batch(self, condition, cutoff):
+        messages = self.messages.c
+        query = export_query(self.db, self.messages, self.users)\
+            .where(condition, messages.created_at < cutoff)\
+            .order_by(messages.created_at, messages.id)\
+            .limit(self.batch_size)
+
+        with self.db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                # Workers running the job at the same time take disjoint batches
+                query = query.with_for_update(skip_locked=True, of=self.messages)
+            rows = connection.execute(query).all()
+            if not rows:
+                return 0
+
+            # Archive first: a crash before the delete commits only repeats rows in the archive
+            if self.archive_dir:
+                self._archive(rows)
+            connection.execute(self.messages.delete().where(messages.id.in_([row.id for row in rows])))
+
+        self.deleted += len(rows)
+        if self.on_deleted is not None:
+            for room_id in {row.room for row in rows}:
+                self.on_deleted(room_id)
+        return len(rows)
+
+    def _archive(self, rows):
+        files = defaultdict(list)
+        for row in rows:
+            room = 'public' if row.room is None else str(row.room)
+            files[(room, row.created_at.strftime('%Y-%m'))].append(row)
+
+        for (room, month), room_rows in files.items():
+            directory = os.path.join(self.archive_dir, room)
+            os.makedirs(directory, exist_ok=True)
+            # Appending adds a gzip member; gzip readers treat the file as one stream
+            with open(os.path.join(directory, f'{month}.ndjson.gz'), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                    f.write(''.join(message_line(row) for row in room_rows).encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+            self.archived += len(room_rows)
+
+    def stats(self):
+        return {
+            'default_days': self.default_days,
+            'archive_dir': self.archive_dir,
+            'archived': self.archived,
+            'deleted': self.deleted,
+            'last_run': self.last_run,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error expiring messages: {str(e)}")
+            self.socketio.sleep(self.interval)
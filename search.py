@@ -0,0 +1,112 @@
+import re
+
+from markupsafe import escape
+
+# Highlight markers returned by the database, swapped for <mark> after escaping
+_START, _STOP = '\x02', '\x03'
+
+
+def highlight_html(text):
+    # Escape the message and turn the database's match markers into <mark> tags
+    return str(escape(text)).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+class MessageSearch:
+    """Full-text search over messages.message.
+
+    PostgreSQL uses a GIN index on to_tsvector(``language``, message); SQLite
+    uses an external-content FTS5 table kept in sync by triggers. Either way
+    the index is updated in the same transaction as every insert and delete
+    (handle_message, the write-behind flusher, imports and retention), so new
+    messages are searchable as soon as they are stored. setup() creates it and
+    is run by a schema migration.
+    """
+
+    def __init__(self, db, table, language='simple'):
+        if not re.fullmatch(r'[a-z_]+', language):
+            raise ValueError(f'Invalid search language: {language}')
+        self.db = db
+        self.table = table
+        self.language = language
+
+    @property
+    def backend(self):
+        dialect = self.db.engine.dialect.name
+        return dialect if dialect in ('postgresql', 'sqlite') else None
+
+    def setup(self, connection):
+        name = self.table.name
+        if connection.dialect.name == 'postgresql':
+            connection.execute(self.db.text(
+                f"CREATE INDEX IF NOT EXISTS ix_{name}_message_fts ON {name} "
+                f"USING GIN (to_tsvector('{self.language}', message))"))
+        elif connection.dialect.name == 'sqlite':
+            exists = connection.execute(self.db.text(
+                "SELECT 1 FROM sqlite_master WHERE name = :fts"), {'fts': f'{name}_fts'}).scalar()
+            connection.execute(self.db.text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name}_fts USING fts5("
+                f"message, content='{name}', content_rowid='id')"))
+            connection.execute(self.db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_fts_insert AFTER INSERT ON {name} BEGIN "
+                f"INSERT INTO {name}_fts(rowid, message) VALUES (new.id, new.message); END"))
+            connection.execute(self.db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_fts_delete AFTER DELETE ON {name} BEGIN "
+                f"INSERT INTO {name}_fts({name}_fts, rowid, message) VALUES ('delete', old.id, old.message); END"))
+            connection.execute(self.db.text(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_fts_update AFTER UPDATE OF message ON {name} BEGIN "
+                f"INSERT INTO {name}_fts({name}_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+                f"INSERT INTO {name}_fts(rowid, message) VALUES (new.id, new.message); END"))
+            if not exists:
+                # Index the messages stored before search was set up
+                connection.execute(self.db.text(f"INSERT INTO {name}_fts({name}_fts) VALUES ('rebuild')"))
+
+    def search(self, text, access, before_id=None, limit=20):
+        """Return (rows, has_more) for messages matching ``text``, newest first.
+
+        ``access`` is a SQL condition limiting the rooms searched and
+        ``before_id`` the last id of the previous page. Results are ordered by
+        id, which follows insertion order. SQLite's FTS5 table is keyed by that
+        id, so it is walked backwards and stops after one page. PostgreSQL's GIN
+        index returns every match as a bitmap, which is then top-N sorted; for a
+        common word that means visiting all its matches (unless the planner
+        walks the primary key backwards instead), so those searches get slower
+        as the table grows. Each row has the message columns plus ``highlight``
+        (marked-up text).
+        """
+        messages = self.table.c
+        if self.backend == 'postgresql':
+            tsquery = self.db.func.websearch_to_tsquery(self.db.literal_column(f"'{self.language}'"), text)
+            match = self.db.text(
+                f"to_tsvector('{self.language}', {self.table.name}.message) @@ websearch_to_tsquery("
+                f"'{self.language}', :search_text)").bindparams(search_text=text)
+            highlight = self.db.func.ts_headline(
+                self.db.literal_column(f"'{self.language}'"), messages.message, tsquery,
+                f'StartSel={_START}, StopSel={_STOP}, HighlightAll=true')
+            query = self.db.select(self.table, highlight.label('highlight')).where(match)
+            order_id = messages.id
+        elif self.backend == 'sqlite':
+            terms = fts5_terms(text)
+            if not terms:
+                return [], False
+            fts = self.db.table(f'{self.table.name}_fts', self.db.column('rowid'))
+            fts_name = self.db.literal_column(f'{self.table.name}_fts')
+            highlight = self.db.func.highlight(fts_name, 0, _START, _STOP)
+            query = self.db.select(self.table, highlight.label('highlight'))\
+                .select_from(fts.join(self.table, messages.id == fts.c.rowid))\
+                .where(fts_name.op('MATCH')(terms))
+            order_id = fts.c.rowid
+        else:
+            raise RuntimeError('Search is not set up for this database')
+
+        query = query.where(access)
+        if before_id is not None:
+            query = query.where(order_id < before_id)
+        query = query.order_by(order_id.desc()).limit(limit + 1)
+
+        rows = self.db.session.execute(query).all()
+        return rows[:limit], len(rows) > limit
+
+
+def fts5_terms(text):
+    # Quote every word so FTS5 operators in user input are matched literally
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
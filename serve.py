@@ -0,0 +1,143 @@
+import os
+import signal
+import time
+
+
+class ProductionServer:
+    """Runs the app on eventlet's WSGI server, one process per worker.
+
+    With ``workers`` > 1 the parent forks that many children listening on
+    ``port``, ``port + 1``, ... (behind a load balancer with sticky sessions)
+    and restarts any that die. SIGTERM or SIGINT drains a worker: ``draining``
+    turns true (readiness fails and new Socket.IO connections are refused),
+    ``on_drain`` runs (flushing queued writes), clients are sent
+    ``server_draining`` so they reconnect elsewhere, and once they have left,
+    or ``drain_seconds`` have passed, the worker disconnects the rest, stops
+    accepting, runs ``on_drain`` once more and exits.
+    """
+
+    def __init__(self, app, socketio, host='0.0.0.0', port=5000, workers=1, max_connections=1000,
+                 drain_seconds=10, reconnect_within=5, on_fork=None, on_drain=None, connected=None):
+        self.app = app
+        self.socketio = socketio
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_connections = max_connections
+        self.drain_seconds = drain_seconds
+        self.reconnect_within = reconnect_within
+        self.on_fork = on_fork
+        self.on_drain = on_drain
+        self.connected = connected or (lambda: 0)
+
+        self.draining = False
+        self.accepting = None
+        self.pool = None
+        self.children = {}  # pid -> worker index
+        self.stopping = False
+
+    def run(self):
+        if self.workers <= 1:
+            self.serve(self.port)
+        else:
+            self.supervise()
+
+    def serve(self, port):
+        import eventlet
+        import eventlet.wsgi
+
+        listener = eventlet.listen((self.host, port))
+        signal.signal(signal.SIGTERM, self._request_drain)
+        signal.signal(signal.SIGINT, self._request_drain)
+        print(f"Worker {os.getpid()} listening on {self.host}:{port}", flush=True)
+
+        # The pool bounds concurrent connections; further ones wait in the listen backlog.
+        # The accept loop runs in its own green thread so drain() can stop it
+        self.pool = eventlet.GreenPool(self.max_connections)
+        self.accepting = eventlet.spawn(eventlet.wsgi.server, listener, self.app,
+                                        custom_pool=self.pool, log_output=False)
+
+        # The signal handler only sets a flag: a green thread spawned from it would not
+        # run until something else woke the hub
+        while not self.draining:
+            if self.accepting.dead:
+                self.accepting.wait()
+                return
+            eventlet.sleep(0.5)
+        self.drain()
+
+    def drain(self):
+        print(f"Worker {os.getpid()} draining", flush=True)
+        self._run_drain_hooks()
+        # Only this worker's clients: through the message queue it would reach every worker's
+        self.socketio.emit('server_draining', {'reconnect_within': self.reconnect_within}, ignore_queue=True)
+
+        deadline = time.monotonic() + self.drain_seconds
+        while self.connected() > 0 and time.monotonic() < deadline:
+            self.socketio.sleep(0.1)
+        if self.connected() > 0:
+            print(f"Disconnecting {self.connected()} clients still connected after {self.drain_seconds}s", flush=True)
+            self.socketio.server.eio.disconnect()
+
+        # Stop accepting (closing idle connections) and wait for requests in progress
+        self.accepting.kill()
+        self.pool.waitall()
+
+        # Messages sent while clients were leaving
+        self._run_drain_hooks()
+        print(f"Worker {os.getpid()} drained", flush=True)
+
+    def supervise(self):
+        signal.signal(signal.SIGTERM, self._stop_children)
+        signal.signal(signal.SIGINT, self._stop_children)
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is not None and not self.stopping:
+                print(f"Worker {pid} exited with status {status}, restarting it")
+                time.sleep(1)
+                self._spawn(index)
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            # Child: drop inherited connections and serve until drained
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                if self.on_fork:
+                    self.on_fork()
+                self.serve(self.port + index)
+            except BaseException as e:
+                print(f"Error in worker {os.getpid()}: {str(e)}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+
+    def _stop_children(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _request_drain(self, signum, frame):
+        self.draining = True
+
+    def _run_drain_hooks(self):
+        if self.on_drain:
+            try:
+                self.on_drain()
+            except Exception as e:
+                print(f"Error flushing before shutdown: {str(e)}")
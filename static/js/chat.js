@@ -28,7 +28,8 @@ document.addEventListener("DOMContentLoaded", () => {
     // ==============================
     // Chat Logic with Socket.IO
     // ==============================
-    const socket = io();
+    // Ask for compact chat messages (see wire.py); servers that do not offer them send JSON
+    const socket = io({ auth: { encoding: "compact" } });
     const messageForm = document.getElementById("messageForm");
     const messageInput = document.getElementById("messageInput");
     const messagesContainer = document.getElementById("messages");
@@ -38,33 +39,269 @@ document.addEventListener("DOMContentLoaded", () => {
     const roomId = urlParams.get("room_id");
     const room = roomId || null;
 
-    // Initialize timestamps for existing messages
-    function initializeTimestamps() {
-        document.querySelectorAll(".timestamp").forEach((el) => {
-            const ts = el.dataset.timestamp;
-            if (ts) el.textContent = formatTimeAgo(ts);
-        });
+    // ==============================
+    // Message list (virtualized)
+    // ==============================
+    // Every loaded message is kept as data in rows, oldest first, but only the
+    // rows in or near the viewport are in the DOM; two spacers stand in for the
+    // rest. Row heights are measured once rendered and estimated until then.
+    // #messages grows with its content; its wrapper is the element that scrolls
+    const historyScroller = messagesContainer.parentElement;
+    const ESTIMATED_ROW_HEIGHT = 88;
+    const OVERSCAN_ROWS = 10;
+
+    const rows = [];
+    const rowIds = new Set();
+    const heights = [];         // measured height per row, undefined until rendered
+    let offsets = [0];          // offsets[i] is the top of row i, offsets[rows.length] the total height
+    let rowElements = new Map(); // rendered rows: message -> element
+    let renderedStart = 0;
+    let renderedEnd = 0;
+    let rowsChanged = false;
+    let stickToBottom = true;
+    let pendingAnchor = null;   // {index, delta} to keep in place across a prepend
+    let renderQueued = false;
+
+    const topSpacer = document.createElement("div");
+    const bottomSpacer = document.createElement("div");
+    messagesContainer.replaceChildren(topSpacer, bottomSpacer);
+
+    function recomputeOffsets(from) {
+        offsets.length = rows.length + 1;
+        for (let i = from; i < rows.length; i++) {
+            offsets[i + 1] = offsets[i] + (heights[i] === undefined ? ESTIMATED_ROW_HEIGHT : heights[i]);
+        }
     }
 
-    // Function to scroll to bottom
-    function scrollToBottom() {
-        const messagesContainer = document.getElementById("messages");
-        if (messagesContainer) {
-            // Use requestAnimationFrame to ensure smooth scrolling
-            requestAnimationFrame(() => {
-                messagesContainer.scrollTop = messagesContainer.scrollHeight;
-            });
+    // Index of the row at y pixels from the top of the list (binary search on offsets)
+    function rowAt(y) {
+        let low = 0;
+        let high = rows.length - 1;
+        while (low < high) {
+            const mid = (low + high + 1) >> 1;
+            if (offsets[mid] <= y) low = mid;
+            else high = mid - 1;
+        }
+        return Math.max(low, 0);
+    }
+
+    // Distance from the top of the scroller's content to the top of the list
+    function listTop() {
+        return messagesContainer.getBoundingClientRect().top - historyScroller.getBoundingClientRect().top
+            + historyScroller.scrollTop;
+    }
+
+    function drawRows(start, end) {
+        const elements = new Map();
+        const fragment = document.createDocumentFragment();
+        fragment.appendChild(topSpacer);
+        for (let i = start; i < end; i++) {
+            const element = rowElements.get(rows[i]) || buildMessageElement(rows[i]);
+            elements.set(rows[i], element);
+            fragment.appendChild(element);
+        }
+        fragment.appendChild(bottomSpacer);
+        messagesContainer.replaceChildren(fragment);
+        rowElements = elements;
+        renderedStart = start;
+        renderedEnd = end;
+        rowsChanged = false;
+    }
+
+    function updateSpacers() {
+        topSpacer.style.height = `${offsets[renderedStart]}px`;
+        bottomSpacer.style.height = `${offsets[rows.length] - offsets[renderedEnd]}px`;
+    }
+
+    // Measure the rendered rows (including the gap below each); returns the first changed index or -1
+    function measureRows() {
+        let changed = -1;
+        const elements = [...rowElements.values(), bottomSpacer];
+        for (let i = renderedStart; i < renderedEnd; i++) {
+            const element = elements[i - renderedStart];
+            const height = elements[i - renderedStart + 1].offsetTop - element.offsetTop;
+            if (heights[i] !== height) {
+                heights[i] = height;
+                if (changed < 0) changed = i;
+            }
+        }
+        return changed;
+    }
+
+    function renderRows() {
+        renderQueued = false;
+        if (rows.length === 0) {
+            drawRows(0, 0);
+            updateSpacers();
+            return;
+        }
+        // Measuring can move rows, which can bring others into view; a few passes settle it
+        for (let pass = 0; pass < 3; pass++) {
+            const top = listTop();
+            if (stickToBottom) historyScroller.scrollTop = historyScroller.scrollHeight;
+            const viewTop = Math.max(historyScroller.scrollTop - top, 0);
+            const anchor = pendingAnchor || { index: rowAt(viewTop), delta: viewTop - offsets[rowAt(viewTop)] };
+            const keepAnchor = pendingAnchor !== null;
+            pendingAnchor = null;
+
+            const viewBottom = offsets[anchor.index] + anchor.delta + historyScroller.clientHeight;
+            const start = Math.max(anchor.index - OVERSCAN_ROWS, 0);
+            const end = Math.min(rowAt(viewBottom) + 1 + OVERSCAN_ROWS, rows.length);
+            if (rowsChanged || start !== renderedStart || end !== renderedEnd) {
+                drawRows(start, end);
+            }
+            updateSpacers();
+
+            const changed = measureRows();
+            if (changed >= 0) {
+                recomputeOffsets(changed);
+                updateSpacers();
+            }
+            if (stickToBottom) {
+                historyScroller.scrollTop = historyScroller.scrollHeight;
+            } else if (changed >= 0 || keepAnchor) {
+                historyScroller.scrollTop = top + offsets[anchor.index] + anchor.delta;
+            }
+            if (changed < 0) return;
         }
     }
 
-    // Initialize timestamps and scroll to bottom after content is loaded
-    window.addEventListener('load', () => {
-        initializeTimestamps();
+    function scheduleRender() {
+        if (renderQueued) return;
+        renderQueued = true;
+        requestAnimationFrame(renderRows);
+    }
+
+    // A message can arrive both live and in a rejoin's replay
+    function isShown(message) {
+        return message.id != null && rowIds.has(message.id);
+    }
+
+    function addRowIds(messages) {
+        messages.forEach(message => {
+            if (message.id != null) rowIds.add(message.id);
+        });
+    }
+
+    function appendRows(messages) {
+        const fresh = messages.filter(message => !isShown(message));
+        if (fresh.length === 0) return;
+        if (shouldAutoScroll()) stickToBottom = true;
+        addRowIds(fresh);
+        const from = rows.length;
+        rows.push(...fresh);
+        recomputeOffsets(from);
+        rowsChanged = true;
+        scheduleRender();
+    }
+
+    // Older history goes in front of the rows; what the user is looking at stays in place
+    function prependRows(messages) {
+        const older = messages.filter(message => !isShown(message));
+        if (older.length === 0) return;
+        const viewTop = Math.max(historyScroller.scrollTop - listTop(), 0);
+        const anchor = pendingAnchor || { index: rowAt(viewTop), delta: viewTop - offsets[rowAt(viewTop)] };
+        addRowIds(older);
+        rows.unshift(...older);
+        heights.unshift(...new Array(older.length));
+        recomputeOffsets(0);
+        pendingAnchor = { index: rows.length === older.length ? 0 : anchor.index + older.length, delta: anchor.delta };
+        stickToBottom = false;
+        rowsChanged = true;
+        renderRows();
+    }
+
+    function replaceRows(messages) {
+        rows.length = 0;
+        heights.length = 0;
+        rowIds.clear();
+        rowElements = new Map();
+        pendingAnchor = null;
+        appendRows(messages);
         scrollToBottom();
+    }
+
+    function scrollToBottom() {
+        stickToBottom = true;
+        scheduleRender();
+    }
+
+    function shouldAutoScroll() {
+        // Within 100px of the bottom counts as "at bottom"
+        return historyScroller.scrollTop + historyScroller.clientHeight >= historyScroller.scrollHeight - 100;
+    }
+
+    historyScroller.addEventListener('scroll', () => {
+        stickToBottom = shouldAutoScroll();
+        scheduleRender();
+        // Fetch the previous page when the user reaches the top
+        if (historyScroller.scrollTop < 100) {
+            loadOlderMessages();
+        }
+    });
+
+    // New widths rewrap messages; the visible rows are measured again on the next render
+    window.addEventListener('resize', () => {
+        rowsChanged = true;
+        scheduleRender();
     });
 
-    // Join room
-    socket.emit("join", { room_id: room });
+    // History pages name each sender once, in users, rather than in every message
+    const profiles = new Map();   // user id -> {name, profile_img}, kept for the page's lifetime
+
+    function expandPage(page) {
+        Object.entries(page.users || {}).forEach(([id, profile]) => profiles.set(id, profile));
+        return (page.messages || []).map(message => {
+            const profile = profiles.get(message.user_id) || { name: "Unknown user", profile_img: null };
+            return { ...message, name: profile.name, profile_img: profile.profile_img };
+        });
+    }
+
+    // The newest page comes with the page as JSON
+    const initialMessages = document.getElementById("initialMessages");
+    appendRows(initialMessages ? expandPage(JSON.parse(initialMessages.textContent)) : []);
+
+    // Newest message shown, used to resume after a reconnect and as the read marker
+    function newestMessageId() {
+        for (let i = rows.length - 1; i >= 0; i--) {
+            if (rows[i].id != null) return Number(rows[i].id);
+        }
+        return null;
+    }
+
+    // Join on every (re)connect with the newest message we have, so the server
+    // replays only what was sent meanwhile; after a long gap it asks for a refetch
+    function joinRoom() {
+        socket.emit("join", { room_id: room, since_id: newestMessageId() }, (response) => {
+            if (response && response.retry_after) {
+                // Rate limited (e.g. everyone reconnecting at once): retry, spread out
+                setTimeout(() => {
+                    if (socket.connected) joinRoom();
+                }, (response.retry_after + Math.random()) * 1000);
+                return;
+            }
+            if (!response || !response.success) return;
+            if (response.refetch) {
+                reloadNewestPage();
+            } else if (response.missed) {
+                appendMissedMessages(expandPage({ messages: response.missed, users: response.users }));
+            }
+            requestMemberSnapshot();
+            markRead();
+        });
+    }
+
+    socket.on("connect", joinRoom);
+
+    // The server is shutting down: reconnect (to another worker) after a random delay,
+    // spreading the reconnects out; the join above then replays what was missed
+    socket.on("server_draining", (data) => {
+        socket.disconnect();
+        setTimeout(() => socket.connect(), Math.random() * ((data && data.reconnect_within) || 5) * 1000);
+    });
+    socket.on("connect_error", (error) => {
+        if (error.message === "draining") setTimeout(() => socket.connect(), 1000 + Math.random() * 4000);
+    });
 
     // Submit new message
     if (messageForm) {
@@ -78,7 +315,6 @@ document.addEventListener("DOMContentLoaded", () => {
                     }
                 });
                 messageInput.value = "";
-                isUserScrolled = false;
                 scrollToBottom();
             }
         });
@@ -87,12 +323,98 @@ document.addEventListener("DOMContentLoaded", () => {
     // Receive message
     socket.on("message", (data) => {
         if (data && !data.error) {
-            appendMessage(data);
-            if (shouldAutoScroll()) {
-                scrollToBottom();
+            appendRows([data]);
+            markRead();
+        }
+    });
+
+    // Receive a batch of messages and render it in one DOM update
+    socket.on("messages_batch", (data) => {
+        if (!data || !data.messages) return;
+        appendRows(data.messages);
+        markRead();
+    });
+
+    // ==============================
+    // Compact messages: [room, [[id, user_id, message, created_ms], ...]]
+    // ==============================
+    let compactQueue = [];        // rows in arrival order, held while a sender is being looked up
+    let fetchingProfiles = false;
+
+    socket.on("m", (data) => {
+        if (!data || !data[1]) return;
+        compactQueue.push(...data[1]);
+        expandCompactMessages();
+    });
+
+    function expandCompactMessages() {
+        const missing = [...new Set(compactQueue.map(row => row[1]))].filter(id => !profiles.has(id));
+        if (missing.length === 0) {
+            const messages = compactQueue.map(([id, userId, message, createdMs]) => ({
+                id,
+                user_id: userId,
+                message,
+                created_at: new Date(createdMs).toISOString(),
+                name: profiles.get(userId).name,
+                profile_img: profiles.get(userId).profile_img,
+            }));
+            compactQueue = [];
+            if (messages.length) {
+                appendRows(messages);
+                markRead();
             }
+            return;
         }
+        if (fetchingProfiles) return;
+        fetchingProfiles = true;
+        socket.emit("profiles", { ids: missing }, (response) => {
+            fetchingProfiles = false;
+            if (!response || response.error) {
+                console.error("Error loading profiles:", response && response.error);
+                if (response && response.retry_after) setTimeout(expandCompactMessages, response.retry_after * 1000);
+                return;
+            }
+            missing.forEach(id => profiles.set(id, response.profiles[id] || { name: "Unknown user", profile_img: null }));
+            expandCompactMessages();
+        });
+    }
+
+    // A lookup cut off by a disconnect is retried on the next connection
+    socket.on("connect", () => {
+        fetchingProfiles = false;
+        expandCompactMessages();
+    });
+
+    // ==============================
+    // Read marker (unread badges on the rooms page)
+    // ==============================
+    const MARK_READ_IDLE_MS = 30000;
+    let readUpTo = null;          // newest message shown while the tab was visible
+    let reportedReadUpTo = null;
+    let markReadTimer = null;
+
+    // Note the newest message as read while visible; it is reported once the room
+    // has been quiet for a while, or right away when the tab is hidden or left
+    function markRead() {
+        if (!room || document.hidden) return;
+        readUpTo = newestMessageId();
+        clearTimeout(markReadTimer);
+        markReadTimer = setTimeout(reportRead, MARK_READ_IDLE_MS);
+    }
+
+    function reportRead() {
+        clearTimeout(markReadTimer);
+        markReadTimer = null;
+        if (!room || readUpTo == null || readUpTo === reportedReadUpTo || !socket.connected) return;
+        reportedReadUpTo = readUpTo;
+        socket.emit("mark_read", { room_id: room, message_id: readUpTo });
+    }
+
+    document.addEventListener("visibilitychange", () => {
+        if (document.hidden) reportRead();
+        else markRead();
     });
+    window.addEventListener("pagehide", reportRead);
 
     // Update member count
     socket.on("member_count", (data) => {
@@ -101,65 +423,191 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     });
 
-    // Append a new message
-    function appendMessage(data) {
+    // ==============================
+    // Member list (versioned deltas)
+    // ==============================
+    const currentUserId = document.body.dataset.userId;
+    const memberListEl = document.getElementById("memberList");
+    const members = new Map();
+    const onlineMembers = new Set();
+    let memberVersion = null;
+
+    function requestMemberSnapshot() {
+        if (!room || !memberListEl) return;
+        socket.emit("member_snapshot", { room_id: room }, (data) => {
+            if (!data || data.error) return;
+            members.clear();
+            data.members.forEach(member => {
+                members.set(member.id, member);
+                if (!profiles.has(member.id)) profiles.set(member.id, { name: member.name, profile_img: member.profile_img });
+            });
+            onlineMembers.clear();
+            data.online.forEach(id => onlineMembers.add(id));
+            memberVersion = data.version;
+            renderMemberList();
+        });
+    }
+
+    // Apply a delta in order, or resync from a snapshot if one was missed
+    function applyMemberDelta(data, apply) {
+        if (!room || data.room_id != room) return;
+        if (memberVersion === null) return;
+        if (data.version <= memberVersion) return;
+        if (data.version !== memberVersion + 1) {
+            requestMemberSnapshot();
+            return;
+        }
+        memberVersion = data.version;
+        apply();
+    }
+
+    function buildMemberElement(member) {
+        const canRemove = memberListEl.dataset.canRemove === "true";
+        const isCreator = member.id === memberListEl.dataset.creatorId;
+        const div = document.createElement("div");
+        div.className = "flex items-center justify-between p-2 rounded-lg hover:bg-accent";
+        div.dataset.memberId = member.id;
+        div.innerHTML = `
+            <div class="flex items-center">
+                <img src="${escapeHTML(member.profile_img || '/static/img/default-profile.png')}"
+                     alt="${escapeHTML(member.name)}"
+                     class="w-6 h-6 rounded-full mr-2">
+                <span class="text-sm">${escapeHTML(member.name)}</span>
+                <span class="presence-dot w-2 h-2 rounded-full ml-2 ${onlineMembers.has(member.id) ? 'bg-green-500' : 'bg-gray-400'}"></span>
+            </div>
+            ${isCreator ?
+                '<span class="text-xs text-secondary">(Creator)</span>' :
+                (canRemove ?
+                    `<button class="remove-member text-red-500 hover:text-red-700">
+                        <i class="fas fa-user-minus"></i>
+                    </button>` :
+                    '')
+            }
+        `;
+        const removeButton = div.querySelector(".remove-member");
+        if (removeButton) {
+            removeButton.addEventListener("click", () => removeMember(memberListEl.dataset.roomId, member.id));
+        }
+        return div;
+    }
+
+    function renderMemberList() {
+        if (!memberListEl) return;
+        const fragment = document.createDocumentFragment();
+        members.forEach(member => fragment.appendChild(buildMemberElement(member)));
+        memberListEl.replaceChildren(fragment);
+    }
+
+    function findMemberElement(userId) {
+        if (!memberListEl) return null;
+        return memberListEl.querySelector(`[data-member-id="${CSS.escape(userId)}"]`);
+    }
+
+    socket.on("member_added", (data) => {
+        applyMemberDelta(data, () => {
+            members.set(data.member.id, data.member);
+            if (memberListEl && !findMemberElement(data.member.id)) {
+                memberListEl.appendChild(buildMemberElement(data.member));
+            }
+        });
+    });
+
+    socket.on("member_removed", (data) => {
+        if (room && data.room_id == room && data.user_id === currentUserId) {
+            alert("You have been removed from this room");
+            window.location.href = "/rooms";
+            return;
+        }
+        applyMemberDelta(data, () => {
+            members.delete(data.user_id);
+            onlineMembers.delete(data.user_id);
+            const el = findMemberElement(data.user_id);
+            if (el) el.remove();
+        });
+    });
+
+    socket.on("presence_changed", (data) => {
+        applyMemberDelta(data, () => {
+            if (data.online) onlineMembers.add(data.user_id);
+            else onlineMembers.delete(data.user_id);
+            const dot = findMemberElement(data.user_id)?.querySelector(".presence-dot");
+            if (dot) {
+                dot.classList.toggle("bg-green-500", data.online);
+                dot.classList.toggle("bg-gray-400", !data.online);
+            }
+        });
+    });
+
+    // Build the DOM element for a single message
+    function buildMessageElement(data) {
         const div = document.createElement("div");
-        div.classList.add("message");
+        div.classList.add("message", "mb-4");
+        if (data.id) div.dataset.messageId = data.id;
         const profileImg = data.profile_img ? data.profile_img : '/static/img/default-profile.png';
         div.innerHTML = `
             <div class="flex items-start">
-                <img class="h-8 w-8 rounded-full mr-3" src="${profileImg}" alt="${data.name}">
+                <img class="h-8 w-8 rounded-full mr-3" src="${escapeHTML(profileImg)}" alt="${escapeHTML(data.name)}">
                 <div class="flex-1">
                     <div class="flex items-center">
-                        <span class="font-semibold text-primary">${data.name}</span>
+                        <span class="font-semibold text-primary">${escapeHTML(data.name)}</span>
                         <span class="ml-2 text-xs text-secondary timestamp" data-timestamp="${data.created_at}">${formatTimeAgo(data.created_at)}</span>
                     </div>
                     <p class="text-secondary">${escapeHTML(data.message)}</p>
                 </div>
             </div>
         `;
-        messagesContainer.appendChild(div);
-        
-        // Use requestAnimationFrame to ensure the DOM is updated before scrolling
-        requestAnimationFrame(() => {
-            if (shouldAutoScroll()) {
-                scrollToBottom();
-            }
-        });
+        return div;
     }
 
-    // Add auto-scroll functionality
-    let isUserScrolled = false;
-    let lastScrollTop = 0;
+    // Messages missed while disconnected; some may also have arrived live since the rejoin
+    function appendMissedMessages(messages) {
+        appendRows(messages);
+    }
 
-    function shouldAutoScroll() {
-        const messagesContainer = document.getElementById("messages");
-        if (!messagesContainer) return false;
-        
-        const currentScrollTop = messagesContainer.scrollTop;
-        const scrollHeight = messagesContainer.scrollHeight;
-        const clientHeight = messagesContainer.clientHeight;
-        
-        // If we're within 100px of the bottom, consider it "at bottom"
-        return currentScrollTop + clientHeight >= scrollHeight - 100;
-    }
-
-    messagesContainer.addEventListener('scroll', () => {
-        const currentScrollTop = messagesContainer.scrollTop;
-        const scrollHeight = messagesContainer.scrollHeight;
-        const clientHeight = messagesContainer.clientHeight;
-        
-        // If user scrolls up, pause auto-scroll
-        if (currentScrollTop < lastScrollTop) {
-            isUserScrolled = true;
-        }
-        // If user scrolls to bottom, resume auto-scroll
-        else if (currentScrollTop + clientHeight >= scrollHeight - 100) {
-            isUserScrolled = false;
-        }
-        
-        lastScrollTop = currentScrollTop;
-    });
+    // Replace everything with the newest page when too much was missed to replay
+    function reloadNewestPage() {
+        fetch(room ? `/get_messages/${room}` : "/get_messages")
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    console.error("Error loading messages:", data.error);
+                    return;
+                }
+                replaceRows(expandPage(data));
+                hasMoreHistory = data.has_more;
+            })
+            .catch(error => console.error("Error loading messages:", error));
+    }
+
+    // ==============================
+    // Load older messages (keyset pagination)
+    // ==============================
+    let hasMoreHistory = messagesContainer.dataset.hasMore === "true";
+    let loadingHistory = false;
+
+    function loadOlderMessages() {
+        if (!hasMoreHistory || loadingHistory) return;
+
+        const oldest = rows.find(message => message.id != null);
+        if (!oldest) return;
+
+        loadingHistory = true;
+        const url = room ? `/get_messages/${room}` : "/get_messages";
+        fetch(`${url}?before_id=${oldest.id}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    console.error("Error loading messages:", data.error);
+                    return;
+                }
+                prependRows(expandPage(data));
+                hasMoreHistory = data.has_more;
+            })
+            .catch(error => console.error("Error loading messages:", error))
+            .finally(() => {
+                loadingHistory = false;
+            });
+    }
 
     // Timestamp formatting
     function formatTimeAgo(isoTimestamp) {
@@ -183,9 +631,11 @@ document.addEventListener("DOMContentLoaded", () => {
         }[tag]));
     }
 
-    // Update timestamps every minute
+    // Update timestamps every minute; only rendered rows have any, the rest are
+    // formatted when they scroll into view
     setInterval(() => {
-        document.querySelectorAll(".timestamp").forEach((el) => {
+        if (document.hidden) return;
+        messagesContainer.querySelectorAll(".timestamp").forEach((el) => {
             const ts = el.dataset.timestamp;
             if (ts) el.textContent = formatTimeAgo(ts);
         });
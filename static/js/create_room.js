@@ -15,7 +15,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const roomData = {
             name: document.getElementById('roomName').value,
             description: document.getElementById('roomDescription').value,
-            is_private: isPrivateCheckbox.checked
+            is_private: isPrivateCheckbox.checked,
+            retention_days: document.getElementById('retentionDays').value
         };
 
         try {
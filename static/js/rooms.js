@@ -1,9 +1,21 @@
 document.addEventListener("DOMContentLoaded", () => {
-    const socket = io();
+    // Opt in to unread_update for the badges on this page
+    const socket = io({ auth: { unread: true } });
     const currentUserId = document.body.dataset.userId;
 
-    // Join notification room for the current user
-    socket.emit('join', { room_id: `notifications_${currentUserId}` });
+    // Join notification room for the current user (again after every reconnect)
+    socket.on('connect', () => {
+        socket.emit('join', { room_id: `notifications_${currentUserId}` });
+    });
+
+    // The server is shutting down: reconnect (to another worker) after a random delay
+    socket.on('server_draining', (data) => {
+        socket.disconnect();
+        setTimeout(() => socket.connect(), Math.random() * ((data && data.reconnect_within) || 5) * 1000);
+    });
+    socket.on('connect_error', (error) => {
+        if (error.message === 'draining') setTimeout(() => socket.connect(), 1000 + Math.random() * 4000);
+    });
 
     // Handle join request notifications
     socket.on('join_request_received', (data) => {
@@ -30,6 +42,15 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     });
 
+    // Unread badges: the server sends each room's message count, the page knows the read marker
+    socket.on('unread_update', (data) => {
+        const badge = document.querySelector(`[data-unread-room="${data.room_id}"]`);
+        if (!badge) return;
+        const unread = Math.max(data.seq - Number(badge.dataset.readSeq), 0);
+        badge.textContent = unread > 99 ? '99+' : unread;
+        badge.classList.toggle('hidden', unread === 0);
+    });
+
     // Theme toggle functionality
     const themeToggle = document.getElementById('themeToggle');
     const prefersDarkScheme = window.matchMedia('(prefers-color-scheme: dark)');
@@ -0,0 +1,47 @@
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small least-recently-used cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size=10000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key, _MISSING)
+        if entry is _MISSING or entry[1] < time.monotonic():
+            if entry is not _MISSING:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,87 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class UnreadCounters:
+    """Unread counts from a per-room message counter and per-user read markers.
+
+    Every stored message bumps its room's ``message_count`` in the same
+    transaction as the insert, and a read marker remembers the count a user had
+    read up to, so a room's unread count is one subtraction. New counts are
+    broadcast as ``unread_update`` {room_id, seq} to the room ``unread:<room>``,
+    which only the rooms page's sockets join (they opt in with ``unread`` in
+    their connect auth); clients subtract their own marker, so a message costs
+    one emit however many members the room has.
+    """
+
+    def __init__(self, db, room_model, marker_model, message_model, socketio):
+        self.db = db
+        self.Room = room_model
+        self.ReadMarker = marker_model
+        self.Message = message_model
+        self.socketio = socketio
+
+    @staticmethod
+    def channel(room_id):
+        return f'unread:{room_id}'
+
+    def bump(self, rows):
+        """Count new messages (dicts with a ``room`` key) in the current transaction.
+
+        Returns {room_id: new message_count}; public chat has no counter.
+        """
+        counts = Counter(row['room'] for row in rows if row['room'] is not None)
+        seqs = {}
+        for room_id, count in counts.items():
+            seqs[room_id] = self.db.session.execute(
+                self.db.update(self.Room)
+                .where(self.Room.id == room_id)
+                .values(message_count=self.db.func.coalesce(self.Room.message_count, 0) + count)
+                .returning(self.Room.message_count)
+            ).scalar()
+        return seqs
+
+    def publish(self, seqs):
+        for room_id, seq in seqs.items():
+            self.socketio.emit('unread_update', {'room_id': room_id, 'seq': seq}, room=self.channel(room_id))
+
+    def mark_read(self, user_id, room_id, message_id=None, pending=()):
+        """Move the user's marker up to ``message_id`` (or the newest message); returns the marker's seq.
+
+        The seq is the room's count minus the stored messages after
+        ``message_id`` in display order, so it only looks at the newer rows.
+        ``pending`` are write-behind rows that are not counted yet; the ones at
+        or before ``message_id`` are added because they will be once flushed.
+        Markers never move backwards, e.g. when an older tab reports in.
+        """
+        seq = self.db.session.query(self.db.func.coalesce(self.Room.message_count, 0))\
+            .filter(self.Room.id == room_id).scalar() or 0
+
+        if message_id is not None:
+            cursor = self.db.session.query(self.Message.created_at, self.Message.id)\
+                .filter(self.Message.id == message_id, self.Message.room == room_id).first()
+            if cursor is not None:
+                seq -= self.db.session.query(self.db.func.count(self.Message.id)).filter(
+                    self.Message.room == room_id,
+                    self.db.or_(
+                        self.Message.created_at > cursor.created_at,
+                        self.db.and_(self.Message.created_at == cursor.created_at, self.Message.id > cursor.id)
+                    )
+                ).scalar()
+            seq += sum(1 for row in pending if row['room'] == room_id and row['id'] <= message_id)
+
+        marker = self.db.session.get(self.ReadMarker, (user_id, room_id))
+        if marker is None:
+            marker = self.ReadMarker(user_id=user_id, room_id=room_id, read_seq=seq)
+            self.db.session.add(marker)
+        elif seq > marker.read_seq:
+            marker.read_seq = seq
+        marker.updated_at = datetime.now(timezone.utc)
+        self.db.session.commit()
+        return marker.read_seq
+
+    def marked_rooms(self, user_id):
+        # Rooms the user has a marker in, i.e. the ones whose unread counts they track
+        return self.db.session.execute(
+            self.db.select(self.ReadMarker.room_id).where(self.ReadMarker.user_id == user_id)
+        ).scalars().all()
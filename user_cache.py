@@ -0,0 +1,80 @@
+import json
+
+from flask_login import UserMixin
+
+from ttl_cache import TTLCache
+
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for a User row, built from a cached profile.
+
+    It is not attached to a database session, so code that needs the ORM
+    object (relationships, updates) has to load the User itself.
+    """
+
+    def __init__(self, id, name, email, profile_img, avatar):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.profile_img = profile_img
+        # profile_img with the default picture filled in, as shown next to messages
+        self.avatar = avatar
+
+
+class UserCache:
+    """Profiles of logged-in users keyed by id.
+
+    Lookups go through a per-process LRU first and then, when ``url`` is a
+    redis:// URL, a copy shared by every worker. Deleting an entry clears this
+    worker and Redis; other workers keep their local copy for up to ``ttl``.
+    """
+
+    def __init__(self, url=None, max_size=50000, ttl=60, shared_ttl=3600, prefix='square-chat:user:'):
+        self.local = TTLCache(max_size=max_size, ttl=ttl)
+        self.redis = None
+        self.shared_ttl = shared_ttl
+        self.prefix = prefix
+        self.shared_hits = 0
+        if url and url.startswith(('redis://', 'rediss://')):
+            import redis
+
+            self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, user_id):
+        profile = self.local.get(user_id)
+        if profile is not None or self.redis is None:
+            return profile
+
+        try:
+            raw = self.redis.get(self.prefix + user_id)
+        except Exception as e:
+            print(f"Error reading user cache: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        self.shared_hits += 1
+        profile = json.loads(raw)
+        self.local.set(user_id, profile)
+        return profile
+
+    def set(self, user_id, profile):
+        self.local.set(user_id, profile)
+        if self.redis is not None:
+            try:
+                self.redis.set(self.prefix + user_id, json.dumps(profile), ex=self.shared_ttl)
+            except Exception as e:
+                print(f"Error writing user cache: {str(e)}")
+
+    def delete(self, user_id):
+        self.local.delete(user_id)
+        if self.redis is not None:
+            try:
+                self.redis.delete(self.prefix + user_id)
+            except Exception as e:
+                print(f"Error invalidating user cache: {str(e)}")
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared'] = self.redis is not None
+        stats['shared_hits'] = self.shared_hits
+        return stats
@@ -0,0 +1,89 @@
+"""Compact encoding of chat messages for Socket.IO clients that ask for it.
+
+A client opts in at connect with ``io({auth: {encoding: 'compact'}})``; the
+server honours it only while socket_compact_encoding is on. Chat messages
+then go out once per encoding, each to its own socket room:
+
+    json      message / messages_batch events, unchanged
+    compact   'm' events: [room, [[id, user_id, message, created_ms], ...]]
+
+Compact rows name the sender by id instead of repeating their name and
+picture URL, and carry epoch milliseconds instead of ISO timestamps. Clients
+look each sender up once per connection with the ``profiles`` event. Other
+events are small or rare and stay JSON for everyone.
+"""
+from datetime import datetime, timezone
+
+JSON = 'json'
+COMPACT = 'compact'
+COMPACT_EVENT = 'm'
+
+
+def epoch_ms(created_at):
+    # created_at as in message payloads: an ISO 8601 string, UTC when naive
+    moment = datetime.fromisoformat(created_at)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def compact_rows(messages):
+    return [[message['id'], message['user_id'], message['message'], epoch_ms(message['created_at'])]
+            for message in messages]
+
+
+class MessageWire:
+    """Sends chat messages to a room in every encoding its clients may use.
+
+    With ``compact_enabled`` off everything goes to the room itself as
+    before. With it on, every connection still joins the room (for member
+    counts, presence and the rest) plus ``<room>#json`` or
+    ``<room>#compact``, and each message is emitted to both of those, which
+    costs one more emit (and message queue publish) per broadcast.
+    """
+
+    def __init__(self, socketio, compact_enabled=False):
+        self.socketio = socketio
+        self.compact_enabled = compact_enabled
+        self.encodings = {}  # sid -> encoding, for connections on this worker
+        self.broadcasts = {JSON: 0, COMPACT: 0}
+
+    def connected(self, sid, auth):
+        requested = auth.get('encoding') if isinstance(auth, dict) else None
+        encoding = COMPACT if self.compact_enabled and requested == COMPACT else JSON
+        self.encodings[sid] = encoding
+        return encoding
+
+    def disconnected(self, sid):
+        self.encodings.pop(sid, None)
+
+    def rooms(self, room, sid):
+        # Socket rooms a connection joins (and leaves) for chat room ``room``
+        if not self.compact_enabled:
+            return [room]
+        return [room, f'{room}#{self.encodings.get(sid, JSON)}']
+
+    def send(self, room, messages, batched=False):
+        """Broadcast message payloads, as one messages_batch event when ``batched``."""
+        json_room = room
+        if self.compact_enabled:
+            json_room = f'{room}#{JSON}'
+            self.socketio.emit(COMPACT_EVENT, [room, compact_rows(messages)], room=f'{room}#{COMPACT}')
+            self.broadcasts[COMPACT] += 1
+
+        if batched:
+            self.socketio.emit('messages_batch', {'room': room, 'messages': messages}, room=json_room)
+        else:
+            for message in messages:
+                self.socketio.emit('message', message, room=json_room)
+        self.broadcasts[JSON] += 1
+
+    def stats(self):
+        connections = {JSON: 0, COMPACT: 0}
+        for encoding in self.encodings.values():
+            connections[encoding] += 1
+        return {
+            'compact_enabled': self.compact_enabled,
+            'connections': connections,
+            'broadcasts': dict(self.broadcasts),
+        }
@@ -0,0 +1,187 @@
+import time
+from collections import deque
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class MessageWriter:
+    """Write-behind persistence for chat messages.
+
+    Messages get their id up front from a block of preallocated ids, are queued
+    in memory and inserted in batches by a background task, so the sender does
+    not wait for a commit. The queue is bounded: when it is full submit() waits
+    for the flusher to catch up and raises WriterBusy if it does not.
+
+    ``before_commit(batch)`` runs inside each batch's transaction and its
+    result is passed to ``after_commit`` once the batch is stored.
+
+    A batch the database rejects (a constraint or a bad value) is written
+    again one row at a time; rows that still fail are dropped into
+    ``dead_letters`` and passed to ``on_dropped``, so one bad row never
+    holds up the queue. Other errors (the database being unreachable) put
+    the batch back and retry it on the next tick.
+    """
+
+    def __init__(self, app, db, model, socketio, batch_size=500, max_pending=10000,
+                 flush_interval=0.05, block_size=1000, submit_timeout=2.0,
+                 before_commit=None, after_commit=None, on_dropped=None, dead_letter_size=1000):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.socketio = socketio
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.block_size = block_size
+        self.submit_timeout = submit_timeout
+        self.before_commit = before_commit
+        self.after_commit = after_commit
+        self.on_dropped = on_dropped
+
+        self.pending = deque()
+        self.in_flight = []  # the batch being written, until it is committed or requeued
+        self.next_id = 0
+        self.block_end = 0
+        self.running = False
+        self.flushed = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.dead_letters = deque(maxlen=dead_letter_size)
+
+    def allocate_id(self):
+        if self.next_id >= self.block_end:
+            self._reserve_block()
+        message_id = self.next_id
+        self.next_id += 1
+        return message_id
+
+    def _reserve_block(self):
+        with self.app.app_context():
+            engine = self.db.engine
+            table = self.model.__table__
+            if engine.dialect.name == 'postgresql':
+                # Draw a whole block from the table's own sequence so ids never
+                # collide with rows inserted synchronously or by other workers
+                ids = self.db.session.execute(self.db.text(
+                    "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                    "FROM generate_series(1, :count)"
+                ), {'table': table.name, 'count': self.block_size}).scalars().all()
+                self.db.session.commit()
+                self.next_id, self.block_end = min(ids), max(ids) + 1
+            else:
+                # Without sequences ids continue from the highest stored row;
+                # only safe with a single writing process
+                current = self.db.session.query(self.db.func.max(table.c.id)).scalar() or 0
+                self.db.session.rollback()
+                start = max(current + 1, self.block_end)
+                self.next_id, self.block_end = start, start + self.block_size
+
+    def submit(self, row):
+        self.start()
+
+        # Backpressure: give the flusher a chance before rejecting the message
+        deadline = time.monotonic() + self.submit_timeout
+        while len(self.pending) >= self.max_pending:
+            if time.monotonic() > deadline:
+                raise WriterBusy('Message queue is full')
+            self.socketio.sleep(self.flush_interval)
+        self.pending.append(row)
+
+    def queued(self):
+        # Rows not committed yet, oldest first. Take it before reading the table:
+        # a row committed in between is then in one or the other
+        return list({row['id']: row for row in [*self.in_flight, *self.pending]}.values())
+
+    def flush(self):
+        # Insert everything queued so far; returns the number of rows written
+        written = 0
+        while self.pending:
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                batch.append(self.pending.popleft())
+            self.in_flight = batch
+
+            with self.app.app_context():
+                try:
+                    self._write(batch)
+                except (IntegrityError, DataError) as e:
+                    print(f"Error flushing messages, writing them one by one: {str(e)}")
+                    self.db.session.rollback()
+                    self.failed_batches += 1
+                    stored, stopped = self._write_each(batch)
+                    written += stored
+                    self.in_flight = []
+                    if stopped:
+                        return written
+                    continue
+                except Exception as e:
+                    print(f"Error flushing messages: {str(e)}")
+                    self.db.session.rollback()
+                    self.failed_batches += 1
+                    # Put the batch back in order and retry on the next tick
+                    self.pending.extendleft(reversed(batch))
+                    self.in_flight = []
+                    return written
+
+            self.in_flight = []
+            written += len(batch)
+        return written
+
+    def _write(self, batch):
+        # One executemany; SQLAlchemy turns it into multi-row INSERTs
+        self.db.session.execute(self.model.__table__.insert(), batch)
+        result = self.before_commit(batch) if self.before_commit else None
+        self.db.session.commit()
+        self.flushed += len(batch)
+
+        if self.after_commit:
+            try:
+                self.after_commit(result)
+            except Exception as e:
+                print(f"Error after flushing messages: {str(e)}")
+
+    def _write_each(self, batch):
+        # Returns (rows stored, whether to stop until the next tick)
+        stored = 0
+        for index, row in enumerate(batch):
+            try:
+                self._write([row])
+                stored += 1
+            except (IntegrityError, DataError) as e:
+                self.db.session.rollback()
+                self._drop(row, e)
+            except Exception as e:
+                print(f"Error flushing messages: {str(e)}")
+                self.db.session.rollback()
+                self.pending.extendleft(reversed(batch[index:]))
+                return stored, True
+        return stored, False
+
+    def _drop(self, row, error):
+        print(f"Dropping message {row.get('id')} the database rejected: {str(error)}")
+        self.dropped += 1
+        self.dead_letters.append(row)
+        if self.on_dropped:
+            try:
+                self.on_dropped(row)
+            except Exception as e:
+                print(f"Error after dropping a message: {str(e)}")
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        # Drain the queue before the process exits
+        self.running = False
+        self.flush()
+
+    def _run(self):
+        while self.running:
+            self.socketio.sleep(self.flush_interval)
+            self.flush()